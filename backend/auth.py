@@ -2,13 +2,16 @@ from datetime import timedelta, datetime
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
 from starlette import status
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from jose import jwt, JWTError
-from database import SessionLocal
+from database import AsyncSessionLocal
 from database import User
+from passwords import PasswordHasher, PasswordHasherBusy
+from cache import LRUCache
 from dotenv import load_dotenv
 import os
 
@@ -29,9 +32,17 @@ router = APIRouter(
 )
 
 
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+# cost 12 takes a few hundred ms per hash; lower it only for tests and benchmarks
+password_hasher = PasswordHasher(rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+                                 workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+                                 max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32")))
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 
+# user id -> the columns the auth checks need; changes made through the ORM in this
+# process invalidate entries, changes from elsewhere show up after USER_CACHE_TTL seconds
+user_cache = LRUCache(max_size=int(os.getenv("USER_CACHE_SIZE", "1024")),
+                      ttl=float(os.getenv("USER_CACHE_TTL", "60")) or None)
+
 
 class CreateUserRequest(BaseModel):
     username: str
@@ -43,51 +54,67 @@ class Token(BaseModel):
     token_type: str
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency,
                       create_user_request: CreateUserRequest):
-    existing_user = db.query(User).filter(User.username == create_user_request.username).first()
+    existing_user = await db.scalar(select(User).where(User.username == create_user_request.username))
     if existing_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Username already exists")
     
     create_user_model = User(
         username=create_user_request.username,
-        hashed_password=bcrypt_context.hash(create_user_request.password),
+        hashed_password=await hash_password(create_user_request.password),
     )
 
     db.add(create_user_model)
-    db.commit()
-    db.refresh(create_user_model)
+    await db.commit()
     return {"message": "User created successfully", "user_id": create_user_model.id}
 
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
                                  db: db_dependency):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail='Could not validate user.')
+    if user.is_active is False:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail='Inactive user.')
     token = create_access_token(user.username, user.id, timedelta(hours=24))
 
     return {'access_token': token, 'token_type': 'bearer'}
 
 
-def authenticate_user(username: str, password: str, db):
-    user = db.query(User).filter(User.username == username).first()
+def too_busy():
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail='Too many concurrent logins, try again shortly.',
+                         headers={'Retry-After': '1'})
+
+
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise too_busy()
+
+
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    try:
+        verified = await password_hasher.verify(password, user.hashed_password)
+    except PasswordHasherBusy:
+        raise too_busy()
+    if not verified:
         return False
     return user
 
@@ -99,7 +126,41 @@ def create_access_token(username: str, user_id: int, expires_delta: timedelta):
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
+def user_snapshot(user: User) -> dict:
+    # rows written before is_active had a default count as active
+    return {'username': user.username, 'id': user.id,
+            'is_active': user.is_active is not False, 'is_admin': bool(user.is_admin)}
+
+
+async def load_user(user_id: int, db: AsyncSession):
+    user = user_cache.get(user_id) if user_cache.enabled else None
+    if user is None:
+        db_user = await db.get(User, user_id)
+        if db_user is None:
+            return None
+        user = user_snapshot(db_user)
+        if user_cache.enabled:
+            user_cache.put(user_id, user)
+    return user
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+    user_cache.invalidate(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    # again after commit, in case a concurrent request cached the old row in between
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(user_id)
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)], db: db_dependency):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get('sub')
@@ -107,7 +168,27 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
         if username is None or user_id is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail='Could not validate user.')
-        return {'username': username, 'id': user_id}
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                             detail='Could not validate user.')
\ No newline at end of file
+                             detail='Could not validate user.')
+
+    user = await load_user(user_id, db)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail='Could not validate user.')
+    if not user['is_active']:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail='Inactive user.')
+    return user
+
+
+async def get_current_admin(user: Annotated[dict, Depends(get_current_user)]):
+    if not user['is_admin']:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail='Admin privileges required.')
+    return user
+
+
+@router.get("/cache")
+async def user_cache_stats(admin: Annotated[dict, Depends(get_current_admin)]):
+    return user_cache.stats()
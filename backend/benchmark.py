@@ -0,0 +1,281 @@
+"""End-to-end benchmark: start the backend on a scratch database with a stub model, load it, compare to a baseline.
+
+    python benchmark.py --samples 50000 --concurrency 1,16 --save-baseline   # once, on the machine used later
+    python benchmark.py --samples 50000 --concurrency 1,16                   # exits 1 on a regression
+
+The stub model is a small forest trained on datasetGeneration.generate_dataset. The database is a fresh
+SQLite file in --workdir unless --database-url points to a (scratch) Postgres database, which is topped up
+to --samples rows. Every scenario (/predict, /save-result, /samples, /auth/token) runs at every concurrency
+level after a short warm-up; throughput and latency percentiles go to --output as JSON.
+
+A result regresses when its throughput drops or its p95/p99 latency grows by more than --tolerance
+relative to --baseline. Baselines only come from --save-baseline runs, and are only comparable on the
+same machine, database and settings, which are recorded next to the numbers.
+Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+import httpx
+import numpy as np
+from loadtest import login, measure
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+TRAINING_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "model_training_scripts")
+
+SCENARIOS = ["predict", "save-result", "samples", "auth-token"]
+SAMPLE_TYPES = ["influent", "effluent", "sludge", "prediction"]
+USERNAME = "benchmark"
+PASSWORD = "benchmark-password"
+
+
+def training_bounds():
+    """The (low, high) range of every parameter in the training data, in the order of PARAMETERS."""
+    sys.path.insert(0, TRAINING_DIR)
+    from datasetGeneration import ranges
+
+    return list(ranges.values())
+
+
+def train_stub_model(path, rows, trees, seed):
+    sys.path.insert(0, TRAINING_DIR)
+    import joblib
+    import pandas as pd
+    from datasetGeneration import generate_dataset, ranges
+    from sklearn.ensemble import RandomForestClassifier
+
+    data = pd.DataFrame(generate_dataset(ranges, rows, rng=np.random.default_rng(seed)))
+    model = RandomForestClassifier(n_estimators=trees, random_state=seed, n_jobs=-1)
+    model.fit(data[list(ranges)], data["Near_Limit"])
+    joblib.dump(model, path)
+    return training_bounds()
+
+
+def random_rows(rng, bounds, n):
+    from stats import PARAMETERS
+
+    low, high = np.array(bounds).T
+    values = rng.uniform(low, high, size=(n, len(bounds)))
+    return [dict(zip(PARAMETERS, map(float, row))) for row in values]
+
+
+def seed_database(url, samples, bounds, seed):
+    """Create the schema and add random samples until the table holds `samples` rows."""
+    os.environ["DATABASE_URL"] = url
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    from sqlalchemy import func, insert, select
+    from database import SampleRecord, SessionLocal
+    from migrations import run_migrations
+    import monitoring
+    import rollups
+
+    run_migrations()
+    rng = np.random.default_rng(seed)
+    with SessionLocal() as db:
+        missing = samples - db.scalar(select(func.count(SampleRecord.id)))
+        for start in range(0, max(missing, 0), 10_000):
+            rows = random_rows(rng, bounds, min(10_000, missing - start))
+            for row in rows:
+                row.update(prediction=int(rng.integers(0, 2)), confidence=float(rng.uniform(50, 100)),
+                           sample_type=SAMPLE_TYPES[int(rng.integers(len(SAMPLE_TYPES)))],
+                           timestamp=date(2024, 1, 1) + timedelta(days=int(rng.integers(0, 365))))
+            db.execute(insert(SampleRecord), rows)
+        rollups.rebuild(db)
+        monitoring.rebuild(db)
+        db.commit()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def uvicorn_command(port, workers):
+    return [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+            "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--no-access-log"]
+
+
+def start_server(command, port, env, log, cwd, startup_timeout, **popen_args):
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT, **popen_args)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}, see {log.name}")
+        try:
+            # also loads the model, so the first measured request does not pay for it
+            if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=5).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"server not ready after {startup_timeout} s, see {log.name}")
+
+
+def request_factory(scenario, rng, bounds, headers):
+    if scenario == "predict":
+        # distinct bodies, so the prediction cache does not answer everything
+        return lambda: {"method": "POST", "url": "/predict", "json": random_rows(rng, bounds, 1)[0]}
+    if scenario == "save-result":
+        def save():
+            body = {**random_rows(rng, bounds, 1)[0], "prediction": int(rng.integers(0, 2)),
+                    "confidence": float(rng.uniform(50, 100)), "date": "2024-06-01",
+                    "sample_type": SAMPLE_TYPES[int(rng.integers(len(SAMPLE_TYPES)))]}
+            return {"method": "POST", "url": "/save-result", "json": body, "headers": headers}
+        return save
+    if scenario == "samples":
+        return lambda: {"method": "GET", "url": "/samples", "params": {
+            "limit": 50, "sample_type": SAMPLE_TYPES[int(rng.integers(len(SAMPLE_TYPES)))]}}
+    if scenario == "auth-token":
+        return lambda: {"method": "POST", "url": "/auth/token", "data": {"username": USERNAME, "password": PASSWORD}}
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+async def drive(args, url, bounds):
+    rng = np.random.default_rng(args.seed)
+    max_clients = max(args.concurrency)
+    limits = httpx.Limits(max_connections=max_clients, max_keepalive_connections=max_clients)
+    results = {}
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        response = await client.post("/auth/", json={"username": USERNAME, "password": PASSWORD})
+        if response.status_code not in (201, 409):
+            response.raise_for_status()
+        headers = await login(client, USERNAME, PASSWORD)
+
+        for scenario in args.scenarios:
+            make_request = request_factory(scenario, rng, bounds, headers)
+            for concurrency in args.concurrency:
+                await measure(client, make_request, concurrency, args.warmup)
+                report = await measure(client, make_request, concurrency, args.duration)
+                results[f"{scenario}@{concurrency}"] = {"scenario": scenario, **report}
+                print(f"{scenario:<12} x{concurrency:<4} {report['throughput_rps']:>8} req/s  "
+                      f"p50 {report['latency_ms']['p50']} ms  p95 {report['latency_ms']['p95']} ms  "
+                      f"p99 {report['latency_ms']['p99']} ms  errors {report['errors']}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as readable lines."""
+    regressions = []
+    for key, result in results.items():
+        before = baseline["results"].get(key)
+        if before is None:
+            continue
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        for name in ("p95", "p99"):
+            old, new = before["latency_ms"][name], result["latency_ms"][name]
+            if old is not None and new is not None and new > old * (1 + tolerance):
+                regressions.append(f"{key}: {name} {old} -> {new} ms")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{key}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="scratch Postgres (or SQLite) database, a fresh SQLite file when omitted")
+    parser.add_argument("--workdir", help="model, database and server log, a temporary directory when omitted")
+    parser.add_argument("--samples", type=int, default=20_000, help="rows in the samples table before the run")
+    parser.add_argument("--model-rows", type=int, default=20_000)
+    parser.add_argument("--model-trees", type=int, default=100)
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=SCENARIOS,
+                        help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")], default=[1, 8, 32],
+                        help="comma-separated client counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario and concurrency")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each measurement")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--workers", type=int, default=1, help="server processes")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed relative drop in throughput or growth in p95/p99 latency")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    temporary = args.workdir is None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="benchmark-"))
+    os.makedirs(args.workdir, exist_ok=True)
+    model_path = os.path.join(args.workdir, "model.pkl")
+    if args.database_url:
+        database_url = args.database_url
+    else:
+        database_path = os.path.join(args.workdir, "benchmark.db")
+        if os.path.exists(database_path):
+            os.remove(database_path)
+        database_url = f"sqlite:///{database_path}"
+
+    print(f"training the stub model ({args.model_rows} rows, {args.model_trees} trees)...")
+    bounds = train_stub_model(model_path, args.model_rows, args.model_trees, args.seed)
+    print(f"seeding {args.samples} samples...")
+    seed_database(database_url, args.samples, bounds, args.seed)
+
+    env = {**os.environ, "DATABASE_URL": database_url, "MODEL_PATH": model_path,
+           "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark"), "ALGORITHM": os.environ.get("ALGORITHM", "HS256"),
+           "LOG_LEVEL": "WARNING"}
+    port = free_port()
+    with open(os.path.join(args.workdir, "server.log"), "w") as log:
+        server = start_server(uvicorn_command(port, args.workers), port, env, log, args.workdir, args.startup_timeout)
+        try:
+            results = asyncio.run(drive(args, f"http://127.0.0.1:{port}", bounds))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "database": database_url.split(":", 1)[0],
+            "samples": args.samples,
+            "model_trees": args.model_trees,
+            "workers": args.workers,
+            "duration": args.duration,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+    if temporary:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"saved as the baseline {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["environment"] != report["environment"]:
+        print(f"warning: baseline environment differs: {baseline['environment']}")
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    print(f"{len(regressions)} regressions (tolerance {args.tolerance:.0%})" if regressions else "no regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
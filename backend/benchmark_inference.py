@@ -0,0 +1,80 @@
+"""Check that the compiled forest matches sklearn bit for bit, then compare their latency.
+
+    python benchmark_inference.py --model model.pkl --batch-size 1000
+
+Exits with status 1 when any probability differs from sklearn's.
+"""
+import argparse
+import statistics
+import sys
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from forest_engine import CompiledForest, parity_report
+
+
+def parity_inputs(model, compiled, rows, rng):
+    n_features = model.n_features_in_
+    # spread around the split points, many rows sitting exactly on a threshold or one float32 step away
+    internal = compiled.left != np.arange(len(compiled.left))
+    X = np.empty((rows, n_features), dtype=np.float32)
+    for j in range(n_features):
+        split_values = compiled.threshold[internal & (compiled.feature == j)]
+        X[:, j] = rng.choice(split_values, size=rows) if len(split_values) else rng.random(rows)
+    on_threshold = rng.random((rows, n_features)) < 0.3
+    X = np.where(on_threshold, X, X * rng.uniform(0.5, 1.5, size=X.shape).astype(np.float32))
+    nudged = rng.random((rows, n_features)) < 0.1
+    X[nudged] = np.nextafter(X[nudged], np.float32(np.inf))
+    X[rng.random((rows, n_features)) < 0.05] = np.nan
+    return X.astype(np.float64)
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="model.pkl")
+    parser.add_argument("--parity-rows", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    start = time.perf_counter()
+    compiled = CompiledForest.from_sklearn(model)
+    print(f"compiled {compiled.n_trees} trees, {len(compiled.feature)} nodes, "
+          f"depth {compiled.max_depth} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(args.seed)
+    report = parity_report(model, compiled, parity_inputs(model, compiled, args.parity_rows, rng))
+    print(f"parity on {report['rows']} rows: {'identical' if report['identical'] else 'MISMATCH'}"
+          f" (max abs diff {report['max_abs_diff']:.3g})")
+
+    columns = model.feature_names_in_
+    row = parity_inputs(model, compiled, 1, rng)
+    batch = parity_inputs(model, compiled, args.batch_size, rng)
+    results = {
+        "sklearn single row": timed(lambda: model.predict_proba(pd.DataFrame(row, columns=columns)), args.repeat),
+        "compiled single row": timed(lambda: compiled.predict_proba(row), args.repeat),
+        "sklearn batch": timed(lambda: model.predict_proba(pd.DataFrame(batch, columns=columns)), args.repeat) / len(batch),
+        "compiled batch": timed(lambda: compiled.predict_proba(batch), args.repeat) / len(batch),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds * 1e6:10.1f} us/row")
+    print(f"single row speedup: {results['sklearn single row'] / results['compiled single row']:.1f}x, "
+          f"batch speedup: {results['sklearn batch'] / results['compiled batch']:.1f}x")
+
+    return 0 if report["identical"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Measure /predict latency on its own and again while many clients log in at the same time.
+
+    uvicorn main:app --port 8000
+    python benchmark_login_storm.py --url http://localhost:8000 --login-clients 32 --predict-clients 4 --duration 15
+
+The user is created on the first run. Every /predict sends a different sample drawn from the training
+ranges, so the prediction cache does not answer them. Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import httpx
+import numpy as np
+from benchmark import request_factory, training_bounds
+from loadtest import percentile
+
+
+async def predict_loop(client, make_request, deadline, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.request(**make_request())
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def login_loop(client, args, deadline, outcomes):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.post("/auth/token", data={"username": args.username, "password": args.password})
+        outcomes.append((response.status_code, time.perf_counter() - start))
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        **{name: round(percentile(latencies, q) * 1000, 2) if latencies else None
+           for name, q in [("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)]},
+    }
+
+
+async def phase(client, args, make_request, with_logins):
+    deadline = time.perf_counter() + args.duration
+    latencies, outcomes = [], []
+    tasks = [predict_loop(client, make_request, deadline, latencies) for _ in range(args.predict_clients)]
+    if with_logins:
+        tasks += [login_loop(client, args, deadline, outcomes) for _ in range(args.login_clients)]
+    await asyncio.gather(*tasks)
+
+    result = {"predict": summary(latencies)}
+    if with_logins:
+        result["login"] = {
+            **summary([seconds for code, seconds in outcomes if code == 200]),
+            "rejected_503": sum(1 for code, _ in outcomes if code == 503),
+            "failed": sum(1 for code, _ in outcomes if code not in (200, 503)),
+        }
+    return result
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.login_clients + args.predict_clients)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        response = await client.post("/auth/", json={"username": args.username, "password": args.password})
+        if response.status_code not in (201, 409):
+            response.raise_for_status()
+        make_request = request_factory("predict", np.random.default_rng(args.seed), training_bounds(), {})
+        await client.request(**make_request())  # load the model outside the measurement
+
+        return {
+            "predict_alone": await phase(client, args, make_request, with_logins=False),
+            "during_login_storm": await phase(client, args, make_request, with_logins=True),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--username", default="login-storm")
+    parser.add_argument("--password", default="login-storm-password")
+    parser.add_argument("--login-clients", type=int, default=32)
+    parser.add_argument("--predict-clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per phase")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Compare the pickled sklearn model with its compact .npz export: file size, load time, RSS and parity.
+
+    python benchmark_model_formats.py --model model.pkl                 # exports model.npz first
+    python benchmark_model_formats.py --model model.pkl --compact model.npz
+
+Load time and RSS are measured in fresh processes. Parity is checked on rows spread around the split
+points (every row must reach the same leaf in every tree) and as accuracy on a labeled dataset from
+datasetGeneration. Exits with status 1 when any leaf or predicted class differs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import joblib
+import numpy as np
+import pandas as pd
+from benchmark_inference import parity_inputs
+from forest_engine import CompiledForest
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+TRAINING_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "model_training_scripts")
+
+LOAD_SNIPPET = """
+import json, sys, time
+sys.path.insert(0, {backend!r})
+def rss_kb():
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+import joblib, numpy, sklearn.ensemble
+from forest_engine import CompiledForest
+before = rss_kb()
+start = time.perf_counter()
+model = CompiledForest.load({path!r}) if {path!r}.endswith(".npz") else joblib.load({path!r}, mmap_mode="r")
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "rss_mb": (rss_kb() - before) / 1024}}))
+"""
+
+
+def measure_load(path, repeat):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", LOAD_SNIPPET.format(backend=BACKEND_DIR, path=path)],
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output))
+    return {
+        "size_mb": round(os.path.getsize(path) / 2 ** 20, 3),
+        "load_ms": round(statistics.median(run["seconds"] for run in runs) * 1000, 1),
+        "rss_mb": round(statistics.median(run["rss_mb"] for run in runs), 1),
+    }
+
+
+def labeled_rows(rows, seed):
+    sys.path.insert(0, TRAINING_DIR)
+    from datasetGeneration import generate_dataset, ranges
+
+    data = pd.DataFrame(generate_dataset(ranges, rows, rng=np.random.default_rng(seed)))
+    return data[list(ranges)].to_numpy(), data["Near_Limit"].to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="model.pkl")
+    parser.add_argument("--compact", help="compact export of --model, written next to it when omitted")
+    parser.add_argument("--parity-rows", type=int, default=50_000)
+    parser.add_argument("--labeled-rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes per format for load time and RSS")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    if not args.compact:
+        args.compact = os.path.splitext(args.model)[0] + ".npz"
+        CompiledForest.from_sklearn(model).save(args.compact)
+        print(f"exported {args.compact}")
+    compact = CompiledForest.load(args.compact)
+
+    results = {"pickle": measure_load(args.model, args.repeat), "compact": measure_load(args.compact, args.repeat)}
+    print(f"{'':>8} {'size MB':>8} {'load ms':>8} {'RSS MB':>7}")
+    for name, result in results.items():
+        print(f"{name:>8} {result['size_mb']:>8} {result['load_ms']:>8} {result['rss_mb']:>7}")
+
+    rng = np.random.default_rng(args.seed)
+    reference = CompiledForest.from_sklearn(model)
+    X = parity_inputs(model, reference, args.parity_rows, rng)
+    same_leaves = bool(np.array_equal(reference.apply(X), compact.apply(X)))
+    columns = getattr(model, "feature_names_in_", None)
+    expected = model.predict_proba(pd.DataFrame(X, columns=columns) if columns is not None else X)
+    actual = compact.predict_proba(X)
+    disagreements = int(np.sum(expected.argmax(axis=1) != actual.argmax(axis=1)))
+    print(f"parity on {len(X)} rows: leaves {'identical' if same_leaves else 'DIFFERENT'}, "
+          f"{disagreements} class disagreements, max abs probability diff {np.max(np.abs(expected - actual)):.3g}")
+
+    X, y = labeled_rows(args.labeled_rows, args.seed)
+    expected = model.classes_.take(model.predict_proba(pd.DataFrame(X, columns=columns) if columns is not None else X)
+                                   .argmax(axis=1))
+    accuracy = {"pickle": float(np.mean(expected == y)), "compact": float(np.mean(compact.predict(X) == y))}
+    print(f"accuracy on {len(y)} labeled rows: pickle {accuracy['pickle']:.5f}, compact {accuracy['compact']:.5f}")
+
+    return 0 if same_leaves and disagreements == 0 and accuracy["pickle"] == accuracy["compact"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""/predict throughput against the number of cores, served by gunicorn with preloaded workers.
+
+    python benchmark_scaling.py --cores 1,2,4,8
+    python benchmark_scaling.py --cores 1,2,4 --server uvicorn     # uvicorn --workers: no preload, for comparison
+
+For every core count N the server runs N workers pinned to N cores, and the load comes from
+--client-processes processes pinned to the cores left over, so the client does not compete with the
+server for CPU (it does when no cores are left, which is reported). Each run reports throughput,
+latency, the speedup over the first core count, and the server's memory summed over its processes,
+as RSS and as PSS: pages shared by the preloaded workers count once in PSS but in every RSS.
+
+The model is a stub forest and the database a fresh SQLite file, as in benchmark.py. Linux only
+(sched_setaffinity and /proc). Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import httpx
+import numpy as np
+from benchmark import BACKEND_DIR, free_port, request_factory, seed_database, start_server, train_stub_model, \
+    uvicorn_command
+from loadtest import summarize, worker
+
+
+def gunicorn_command(port, workers):
+    return [sys.executable, "-m", "gunicorn", "main:app", "--chdir", BACKEND_DIR,
+            "--config", os.path.join(BACKEND_DIR, "gunicorn.conf.py"),
+            "--bind", f"127.0.0.1:{port}", "--workers", str(workers)]
+
+
+def process_tree(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # the command name may contain spaces, the fields after it do not
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def memory_mb(pid):
+    """RSS and PSS of a process and all its descendants, in MB."""
+    totals = {"Rss": 0, "Pss": 0}
+    for process in process_tree(pid):
+        try:
+            with open(f"/proc/{process}/smaps_rollup") as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key in totals:
+                        totals[key] += int(value.split()[0])
+        except OSError:
+            continue
+    return {"rss_mb": round(totals["Rss"] / 1024, 1), "pss_mb": round(totals["Pss"] / 1024, 1)}
+
+
+def client_process(url, concurrency, duration, bounds, seed, cores):
+    if cores:
+        os.sched_setaffinity(0, cores)
+
+    async def run():
+        rng = np.random.default_rng(seed)
+        make_request = request_factory("predict", rng, bounds, {})
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        latencies, errors = [], []
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*[worker(client, make_request, start + duration, latencies, errors)
+                                   for _ in range(concurrency)])
+        return latencies, len(errors), time.perf_counter() - start
+
+    return asyncio.run(run())
+
+
+def drive(pool, args, url, bounds, concurrency, duration, client_cores):
+    per_process = [concurrency // args.client_processes + (i < concurrency % args.client_processes)
+                   for i in range(args.client_processes)]
+    futures = [pool.submit(client_process, url, clients, duration, bounds, args.seed + i, client_cores)
+               for i, clients in enumerate(per_process) if clients]
+    latencies, errors, elapsed = [], 0, 0.0
+    for future in futures:
+        process_latencies, process_errors, process_elapsed = future.result()
+        latencies.extend(process_latencies)
+        errors += process_errors
+        elapsed = max(elapsed, process_elapsed)
+    return summarize(latencies, errors, elapsed, concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cores", type=lambda v: [int(c) for c in v.split(",")], default=[1, 2, 4],
+                        help="comma-separated core counts, one worker per core")
+    parser.add_argument("--server", choices=["gunicorn", "uvicorn"], default="gunicorn")
+    parser.add_argument("--clients-per-core", type=int, default=8, help="concurrent requests per server core")
+    parser.add_argument("--client-processes", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=15.0, help="measured seconds per core count")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--model-rows", type=int, default=20_000)
+    parser.add_argument("--model-trees", type=int, default=300)
+    parser.add_argument("--threadpool-size", type=int, help="THREADPOOL_SIZE for the workers")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_scaling.json")
+    args = parser.parse_args()
+
+    available = sorted(os.sched_getaffinity(0))
+    workdir = tempfile.mkdtemp(prefix="benchmark-scaling-")
+    model_path = os.path.join(workdir, "model.pkl")
+    database_url = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    print(f"training the stub model ({args.model_rows} rows, {args.model_trees} trees)...")
+    bounds = train_stub_model(model_path, args.model_rows, args.model_trees, args.seed)
+    seed_database(database_url, 1000, bounds, args.seed)
+
+    env = {**os.environ, "DATABASE_URL": database_url, "MODEL_PATH": model_path,
+           "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark"), "ALGORITHM": os.environ.get("ALGORITHM", "HS256"),
+           "LOG_LEVEL": "WARNING", "JOB_DIR": os.path.join(workdir, "jobs")}
+    if args.threadpool_size:
+        env["THREADPOOL_SIZE"] = str(args.threadpool_size)
+    command = gunicorn_command if args.server == "gunicorn" else uvicorn_command
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.client_processes) as pool:
+        for cores in args.cores:
+            if cores > len(available):
+                print(f"skipping {cores} cores, only {len(available)} available")
+                continue
+            server_cores, client_cores = available[:cores], available[cores:]
+            port = free_port()
+            with open(os.path.join(workdir, f"server-{cores}.log"), "w") as log:
+                server = start_server(command(port, cores), port, env, log, workdir, args.startup_timeout,
+                                      preexec_fn=lambda: os.sched_setaffinity(0, server_cores))
+                try:
+                    url = f"http://127.0.0.1:{port}"
+                    concurrency = args.clients_per_core * cores
+                    drive(pool, args, url, bounds, concurrency, args.warmup, client_cores)
+                    report = drive(pool, args, url, bounds, concurrency, args.duration, client_cores)
+                    memory = memory_mb(server.pid)
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+
+            first = results[0] if results else None
+            speedup = report["throughput_rps"] / first["throughput_rps"] if first else 1.0
+            results.append({"cores": cores, "client_shares_cores": not client_cores, **memory,
+                            "speedup": round(speedup, 2),
+                            "efficiency": round(speedup * (first["cores"] if first else cores) / cores, 2),
+                            **report})
+            print(f"{cores:>3} cores  {report['throughput_rps']:>8} req/s  x{speedup:<5.2f} "
+                  f"p50 {report['latency_ms']['p50']} ms  p95 {report['latency_ms']['p95']} ms  "
+                  f"errors {report['errors']}  RSS {memory['rss_mb']} MB  PSS {memory['pss_mb']} MB"
+                  + ("  (client on the same cores)" if not client_cores else ""))
+
+    with open(args.output, "w") as f:
+        json.dump({"server": args.server, "available_cores": len(available), "model_trees": args.model_trees,
+                   "results": results}, f, indent=2)
+    print(f"results written to {args.output}")
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""Seed a synthetic samples table and check the query plans and latency of the /samples access paths.
+
+Covers the paged listing, /samples/stats (from the daily rollups, and from the raw samples on
+Postgres), /samples/export and the rollup maintenance of a delete. Exits with status 1 when a query
+falls back to a full table scan, sorts where an index should give the order, or is slower than its
+latency budget: --budget-ms for the lookups and pages, --bulk-budget-ms for the stats and exports,
+which read every row of their range. It can guard schema changes in CI:
+
+    python check_query_plans.py --rows 200000 --budget-ms 25 --bulk-budget-ms 250
+    python check_query_plans.py --database-url postgresql://localhost/water_plans
+
+Never point it at a production database, it inserts the synthetic rows it measures.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+
+SAMPLE_TYPES = ["influent", "effluent", "sludge", "prediction"]
+PARAMETERS = ["Ammonium", "Phosphate", "COD", "BOD", "Conductivity", "PH", "Nitrogen", "Nitrate", "Turbidity", "TSS"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None,
+                        help="defaults to a throwaway SQLite file")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--stats-days", type=int, default=7, help="date range of the stats and export queries")
+    parser.add_argument("--budget-ms", type=float, default=25.0)
+    parser.add_argument("--bulk-budget-ms", type=float, default=250.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/query_plans.db"
+
+from sqlalchemy import func, insert, select  # noqa: E402
+from database import SessionLocal, SampleRecord, User, engine  # noqa: E402
+from exports import export_statement  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from queries import sample_filters, samples_query  # noqa: E402
+from rollups import sample_group_filters  # noqa: E402
+import rollups  # noqa: E402
+from stats import rollup_stats_query, sample_stats_query  # noqa: E402
+
+
+def seed(db, rows, users):
+    if db.query(func.count(SampleRecord.id)).scalar() >= rows:
+        return
+    print(f"seeding {rows} samples...")
+    db.execute(insert(User), [{"username": f"plan_user_{i}", "hashed_password": "-"} for i in range(users)])
+    user_ids = [user.id for user in db.query(User.id)]
+
+    rng = random.Random(42)
+    start = date.today() - timedelta(days=3 * 365)
+    batch = []
+    for _ in range(rows):
+        row = {param: rng.random() * 10 for param in PARAMETERS}
+        row.update(prediction=rng.randint(0, 1), confidence=rng.random() * 100,
+                   sample_type=rng.choice(SAMPLE_TYPES), user_id=rng.choice(user_ids),
+                   timestamp=start + timedelta(days=rng.randrange(3 * 365)))
+        batch.append(row)
+        if len(batch) == 10_000:
+            db.execute(insert(SampleRecord), batch)
+            batch = []
+    if batch:
+        db.execute(insert(SampleRecord), batch)
+    rollups.rebuild(db)
+    db.commit()
+
+
+def explain(connection, sql):
+    if connection.dialect.name == "sqlite":
+        return [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+    if connection.dialect.name == "postgresql":
+        plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql).scalar()
+        nodes, stack = [], [plan[0]["Plan"]]
+        while stack:
+            node = stack.pop()
+            nodes.append(f"{node['Node Type']} {node.get('Relation Name', '')} {node.get('Index Name', '')}".strip())
+            stack.extend(node.get("Plans", []))
+        return nodes
+    raise SystemExit(f"Unsupported dialect {connection.dialect.name}")
+
+
+def plan_problems(plan, kind):
+    problems = []
+    for step in plan:
+        # the pages may walk an index until their LIMIT, the stats have none: any scan of the rollups reads them all
+        if step in ("SCAN samples", "Seq Scan samples", "Seq Scan sample_daily_rollups") \
+                or step.startswith("SCAN sample_daily_rollups"):
+            problems.append("full table scan")
+        # stats group by a computed time bucket, which no index orders
+        if kind != "stats" and ("TEMP B-TREE" in step or step.startswith("Sort")):
+            problems.append("explicit sort")
+    return problems
+
+
+def query_shapes(db, user_id, sample_type, page_size, stats_days):
+    """(name, statement, kind) of every checked query, kind being "page", "stats" or "export"."""
+    first = samples_query(db, user_id=user_id, sample_type=sample_type).limit(page_size + 1)
+    cursor = first.all()[page_size // 2]
+    after = (cursor.timestamp, cursor.id)
+    yield "GET /samples?user_id&sample_type", samples_query(db, user_id=user_id, sample_type=sample_type).limit(page_size + 1), "page"
+    yield "GET /samples?user_id&sample_type&cursor", samples_query(db, user_id=user_id, sample_type=sample_type, after=after).limit(page_size + 1), "page"
+    yield "GET /samples?user_id", samples_query(db, user_id=user_id).limit(page_size + 1), "page"
+    yield "GET /samples?user_id&cursor", samples_query(db, user_id=user_id, after=after).limit(page_size + 1), "page"
+    yield "GET /samples?sample_type", samples_query(db, sample_type=sample_type).limit(page_size + 1), "page"
+    yield "GET /samples?sample_type&cursor", samples_query(db, sample_type=sample_type, after=after).limit(page_size + 1), "page"
+    yield "GET /samples", samples_query(db).limit(page_size + 1), "page"
+    yield "GET /samples?cursor", samples_query(db, after=after).limit(page_size + 1), "page"
+    yield "GET /samples?fields", samples_query(db, columns=["id", "COD", "timestamp"]).limit(page_size + 1), "page"
+    yield "GET|DELETE /samples/{id}", db.query(SampleRecord).filter(SampleRecord.id == cursor.id), "page"
+
+    date_to = db.query(func.max(SampleRecord.timestamp)).scalar()
+    date_from = date_to - timedelta(days=stats_days - 1)
+    stats_shapes = [
+        ("", {}),
+        ("&user_id&sample_type", {"user_id": user_id, "sample_type": sample_type}),
+        ("&group_by_user", {"group_by_user": True}),
+    ]
+    for suffix, filters in stats_shapes:
+        yield (f"GET /samples/stats?date_from&date_to{suffix}",
+               rollup_stats_query(db, "day", date_from=date_from, date_to=date_to, **filters), "stats")
+    if engine.dialect.name == "postgresql":
+        # with percentiles the endpoint aggregates the raw samples, which only Postgres does
+        for suffix, filters in stats_shapes:
+            yield (f"GET /samples/stats?date_from&date_to&percentiles{suffix}",
+                   sample_stats_query(db, "day", date_from=date_from, date_to=date_to, **filters), "stats")
+
+    for suffix, filters in [("user_id&sample_type", {"user_id": user_id, "sample_type": sample_type}),
+                            ("sample_type&date_from&date_to",
+                             {"sample_type": sample_type, "date_from": date_from, "date_to": date_to})]:
+        where = sample_filters(**filters)
+        yield f"GET /samples/export?{suffix} (ETag)", select(func.count(SampleRecord.id), func.max(SampleRecord.id)).where(*where), "export"
+        yield f"GET /samples/export?{suffix}", export_statement(where), "export"
+
+    record = db.get(SampleRecord, cursor.id)
+    for parameter in ["COD", "PH"]:
+        column = getattr(SampleRecord, parameter)
+        yield (f"DELETE /samples/{{id}} rollup {parameter} min/max",
+               select(func.min(column), func.max(column)).where(*sample_group_filters(record), column.isnot(None)), "page")
+
+
+def main():
+    run_migrations(engine)
+    db = SessionLocal()
+    try:
+        seed(db, args.rows, args.users)
+        connection = db.connection()
+        connection.exec_driver_sql("ANALYZE")
+
+        user_id = db.query(User.id).order_by(User.id).first()[0]
+        failures = 0
+        for name, query, kind in query_shapes(db, user_id, "effluent", args.page_size, args.stats_days):
+            statement = getattr(query, "statement", query)
+            sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            problems = plan_problems(explain(connection, sql), kind)
+
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                db.execute(statement).all()
+                timings.append((time.perf_counter() - start) * 1000)
+            latency = statistics.median(timings)
+            budget = args.budget_ms if kind == "page" else args.bulk_budget_ms
+            if latency > budget:
+                problems.append(f"{latency:.1f} ms over the {budget:.1f} ms budget")
+
+            failures += bool(problems)
+            print(f"{'FAIL' if problems else 'ok':4}  {latency:8.2f} ms  {name}  {'; '.join(problems)}")
+    finally:
+        db.close()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
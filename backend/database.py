@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, Float, String, Boolean, ForeignKey, Date
+from sqlalchemy import create_engine, make_url, Column, Integer, Float, String, Boolean, ForeignKey, Date, Index
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import date
@@ -13,9 +14,63 @@ if not DATABASE_URL:
 
 DB_URL = DATABASE_URL
 
-engine = create_engine(DB_URL)  #  , connect_args={"check_same_thread": False}) - for sqlite only
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+# drivers used by the app's async engine; scripts and migrations keep the sync one
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_url(url: str):
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql" and "sslmode" in url.query:
+        # asyncpg takes the libpq sslmode values under the name ssl
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": url.query["sslmode"]})
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def engine_options(url, is_async: bool = False) -> dict:
+    url = make_url(url)
+    if url.get_backend_name() != "postgresql":
+        return {}
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+    }
+    if DB_STATEMENT_TIMEOUT_MS:
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+engine = create_engine(DB_URL, **engine_options(DB_URL))  #  , connect_args={"check_same_thread": False}) - for sqlite only
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_url(DB_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def _forget_parent_connections():
+    # connections opened before a fork (migrations in a preloading server) stay with the parent;
+    # close=False leaves them open for it instead of closing them under it
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_parent_connections)
+
+
 Base = declarative_base()
 
 class SampleRecord(Base):
@@ -40,6 +95,59 @@ class SampleRecord(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User", back_populates="samples")
 
+    # one index per /samples filter combination, each matching the (timestamp, id) DESC keyset order
+    __table_args__ = (
+        Index("ix_samples_user_type_timestamp", user_id, sample_type, timestamp.desc(), id.desc()),
+        Index("ix_samples_user_timestamp", user_id, timestamp.desc(), id.desc()),
+        Index("ix_samples_type_timestamp", sample_type, timestamp.desc(), id.desc()),
+        Index("ix_samples_timestamp", timestamp.desc(), id.desc()),
+    )
+
+
+class SampleDailyRollup(Base):
+    __tablename__ = "sample_daily_rollups"
+
+    # samples without a user or sample type are rolled up under 0 and ''
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    sample_type = Column(String, primary_key=True)
+    parameter = Column(String, primary_key=True)
+    value_count = Column(Integer, nullable=False, default=0)
+    value_sum = Column(Float, nullable=False, default=0.0)
+    value_sum_sq = Column(Float, nullable=False, default=0.0)
+    value_min = Column(Float, nullable=True)
+    value_max = Column(Float, nullable=True)
+    near_limit_count = Column(Integer, nullable=False, default=0)
+    exceed_count = Column(Integer, nullable=False, default=0)
+
+
+class SampleDriftStats(Base):
+    __tablename__ = "sample_drift_stats"
+
+    # scope '*' covers all samples, the others one sample_type each; see monitoring.py
+    scope = Column(String, primary_key=True)
+    parameter = Column(String, primary_key=True)
+    value_count = Column(Integer, nullable=False, default=0)
+    # exponentially weighted sums, the newest sample weighted most; divided by ewm_weight they are averages
+    ewm_weight = Column(Float, nullable=False, default=0.0)
+    ewm_sum = Column(Float, nullable=False, default=0.0)
+    ewm_sum_sq = Column(Float, nullable=False, default=0.0)
+    ewm_near_limit = Column(Float, nullable=False, default=0.0)
+    ewm_exceed = Column(Float, nullable=False, default=0.0)
+    # histogram over the training range: bin_0 below it, bin_1..bin_10 equal widths inside, bin_11 above
+    bin_0 = Column(Float, nullable=False, default=0.0)
+    bin_1 = Column(Float, nullable=False, default=0.0)
+    bin_2 = Column(Float, nullable=False, default=0.0)
+    bin_3 = Column(Float, nullable=False, default=0.0)
+    bin_4 = Column(Float, nullable=False, default=0.0)
+    bin_5 = Column(Float, nullable=False, default=0.0)
+    bin_6 = Column(Float, nullable=False, default=0.0)
+    bin_7 = Column(Float, nullable=False, default=0.0)
+    bin_8 = Column(Float, nullable=False, default=0.0)
+    bin_9 = Column(Float, nullable=False, default=0.0)
+    bin_10 = Column(Float, nullable=False, default=0.0)
+    bin_11 = Column(Float, nullable=False, default=0.0)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -0,0 +1,200 @@
+"""Sample history exports, read from a server-side cursor one partition at a time.
+
+CSV and Parquet are streamed while the query runs. XLSX (a zip archive) and any request
+with a Range header are written to a file first, which is kept for EXPORT_CACHE_TTL
+seconds under the export's ETag, so resumed downloads do not rerun the query.
+"""
+import csv
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from database import AsyncSessionLocal, SampleRecord
+from stats import PARAMETERS
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "sample-exports")
+EXPORT_CACHE_TTL = float(os.getenv("EXPORT_CACHE_TTL", "3600"))
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# same headers as the exports the frontend used to build
+PARAMETER_HEADERS = {
+    "Ammonium": "Ammonium (mg/L)",
+    "Phosphate": "Phosphate (mg/L)",
+    "COD": "COD (mg/L)",
+    "BOD": "BOD (mg/L)",
+    "Conductivity": "Conductivity (mS/m)",
+    "PH": "pH",
+    "Nitrogen": "Nitrogen Total (mg/L)",
+    "Nitrate": "Nitrate (mg/L)",
+    "Turbidity": "Turbidity (NTU)",
+    "TSS": "TSS (mg/L)",
+}
+HEADERS = ["ID", "Timestamp", *PARAMETER_HEADERS.values(), "Sample Type", "Prediction", "Confidence (%)"]
+COLUMNS = [SampleRecord.id, SampleRecord.timestamp, *[getattr(SampleRecord, p) for p in PARAMETERS],
+           SampleRecord.sample_type, SampleRecord.prediction, SampleRecord.confidence]
+PREDICTION_LABELS = {0: "normal", 1: "warning"}
+
+
+def content_disposition(filename: str, export_format: str) -> str:
+    name = re.sub(r"[^\w\- .]", "_", filename, flags=re.ASCII).strip(" .") or "samples"
+    return f'attachment; filename="{name}.{export_format}"'
+
+
+def export_statement(filters: list):
+    return select(*COLUMNS).where(*filters).order_by(SampleRecord.timestamp.desc(), SampleRecord.id.desc())
+
+
+async def export_etag(db, export_format: str, filters: list) -> str:
+    """Changes whenever a matching sample is added or deleted (samples are never updated in place)."""
+    count, last_id = (await db.execute(select(func.count(SampleRecord.id), func.max(SampleRecord.id))
+                                       .where(*filters))).one()
+    criteria = " AND ".join(str(f.compile(compile_kwargs={"literal_binds": True})) for f in filters)
+    digest = hashlib.sha256(f"{export_format}|{criteria}|{count}|{last_id}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def to_values(row) -> list:
+    sample_id, timestamp, *values, sample_type, prediction, confidence = row
+    unscored = prediction is None or prediction == -1
+    return [sample_id, timestamp, *values, sample_type,
+            None if unscored else PREDICTION_LABELS.get(prediction, str(prediction)),
+            None if unscored or confidence == -1 else confidence]
+
+
+async def iter_partitions(statement):
+    # its own session: the request's session is closed before a streaming body is sent
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for partition in result.partitions(EXPORT_CHUNK_SIZE):
+            yield partition
+
+
+def csv_lines(rows) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(to_values(row) for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def csv_chunks(statement):
+    yield ",".join(HEADERS).encode() + b"\r\n"
+    async for partition in iter_partitions(statement):
+        yield await run_in_threadpool(csv_lines, partition)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last take()."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        data, self._buffer = bytes(self._buffer), bytearray()
+        return data
+
+
+def parquet_table(rows):
+    import pyarrow as pa
+
+    columns = list(zip(*[to_values(row) for row in rows])) or [[] for _ in HEADERS]
+    types = [pa.int64(), pa.date32(), *[pa.float64()] * len(PARAMETERS), pa.string(), pa.string(), pa.float64()]
+    return pa.Table.from_arrays([pa.array(column, type=t) for column, t in zip(columns, types)], names=HEADERS)
+
+
+async def parquet_chunks(statement):
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    async for partition in iter_partitions(statement):
+        table = await run_in_threadpool(parquet_table, partition)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        # one row group per partition, flushed to the client right away
+        await run_in_threadpool(writer.write_table, table)
+        yield sink.take()
+    if writer is None:
+        writer = pq.ParquetWriter(sink, parquet_table([]).schema)
+    writer.close()
+    yield sink.take()
+
+
+async def stream_export(statement, export_format: str):
+    chunks = csv_chunks if export_format == "csv" else parquet_chunks
+    async for chunk in chunks(statement):
+        yield chunk
+
+
+async def write_xlsx(statement, path: str):
+    from openpyxl import Workbook
+
+    # write_only keeps only the current row in memory and spools the sheet to a temp file
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Samples")
+    sheet.append(HEADERS)
+
+    def append_rows(rows):
+        for row in rows:
+            sheet.append(to_values(row))
+
+    async for partition in iter_partitions(statement):
+        await run_in_threadpool(append_rows, partition)
+    await run_in_threadpool(workbook.save, path)
+
+
+def _remove_expired():
+    now = time.time()
+    for name in os.listdir(EXPORT_CACHE_DIR):
+        path = os.path.join(EXPORT_CACHE_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > EXPORT_CACHE_TTL:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def export_file(statement, export_format: str, etag: str) -> str:
+    """Path of the finished export for this ETag, built on the first request."""
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_CACHE_DIR, etag.strip('"') + f".{export_format}")
+    if os.path.exists(path):
+        return path
+
+    await run_in_threadpool(_remove_expired)
+    fd, tmp_path = tempfile.mkstemp(dir=EXPORT_CACHE_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        if export_format == "xlsx":
+            await write_xlsx(statement, tmp_path)
+        else:
+            with open(tmp_path, "wb") as f:
+                async for chunk in stream_export(statement, export_format):
+                    f.write(chunk)
+        # concurrent builds of the same export produce the same bytes, the last rename wins
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
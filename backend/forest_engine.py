@@ -0,0 +1,188 @@
+import numpy as np
+
+# layout version of the .npz files written by CompiledForest.save
+COMPACT_FORMAT_VERSION = 1
+
+
+def float32_at_most(values):
+    """Largest float32 <= each value. A float32 input x satisfies x <= t exactly when x <= float32_at_most(t),
+    and sklearn casts inputs to float32 before comparing, so the rounded thresholds split the same way."""
+    rounded = values.astype(np.float32)
+    above = rounded > values
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+class CompiledForest:
+    """A fitted RandomForestClassifier flattened into plain NumPy arrays.
+
+    All trees share one node table, leaves point to themselves, and every row is walked
+    through all trees at once, one level per step, without per-tree Python code or
+    sklearn's input validation. The arithmetic mirrors sklearn's exactly
+    (float32 inputs against float64 thresholds, per-tree normalized leaf values
+    summed tree by tree), so the probabilities are bit-identical.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, leaf_proba, roots, max_depth,
+                 classes, feature_names=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.leaf_proba = leaf_proba
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.feature_names_in_ = feature_names
+
+    @classmethod
+    def from_sklearn(cls, model):
+        if getattr(model, "n_outputs_", 1) != 1:
+            raise ValueError("Only single-output forests can be compiled")
+
+        n_classes = int(model.n_classes_)
+        features, thresholds, lefts, rights, missing, probas, roots = [], [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            missing.append(tree.missing_go_to_left.astype(bool))
+
+            # same normalization as DecisionTreeClassifier.predict_proba
+            proba = tree.value[:, 0, :n_classes].copy()
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            proba /= normalizer
+            probas.append(proba)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            missing_left=np.concatenate(missing),
+            leaf_proba=np.concatenate(probas),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max(estimator.tree_.max_depth for estimator in model.estimators_),
+            classes=model.classes_,
+            feature_names=getattr(model, "feature_names_in_", None),
+        )
+
+    def save(self, path: str):
+        """Write only what inference needs, the compact .npz that load() reads.
+
+        Thresholds and leaf probabilities are stored as float32 and node indices as int32. The
+        values no walk reads (thresholds and missing-value directions of leaves, probabilities of
+        internal nodes) are zeroed so they compress away, and the arrays are zlib-compressed
+        (np.savez_compressed).
+        """
+        if len(self.left) > np.iinfo(np.int32).max:
+            raise ValueError(f"{len(self.left)} nodes do not fit int32 indices")
+        is_leaf = self.left == np.arange(len(self.left))
+        leaf_proba = self.leaf_proba.astype(np.float32)
+        leaf_proba[~is_leaf] = 0.0
+        feature_dtype = np.int16 if self.feature.max(initial=0) <= np.iinfo(np.int16).max else np.int32
+        feature_names = self.feature_names_in_
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                format_version=np.int32(COMPACT_FORMAT_VERSION),
+                feature=self.feature.astype(feature_dtype),
+                threshold=float32_at_most(np.where(is_leaf, 0.0, self.threshold)),
+                left=self.left.astype(np.int32),
+                right=self.right.astype(np.int32),
+                missing_left=self.missing_left & ~is_leaf,
+                leaf_proba=leaf_proba,
+                roots=self.roots.astype(np.int32),
+                max_depth=np.int32(self.max_depth),
+                classes=self.classes_,
+                feature_names=np.asarray(feature_names if feature_names is not None else [], dtype=str),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledForest":
+        """Read the compact .npz written by save().
+
+        Thresholds there are float32, rounded down, which splits float32 inputs exactly like the
+        float64 originals; leaf probabilities are float32, so probabilities differ from sklearn's
+        in the last digits and are accumulated in float64.
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            version = int(arrays["format_version"])
+            if version != COMPACT_FORMAT_VERSION:
+                raise ValueError(f"Unsupported compact model format {version}, expected {COMPACT_FORMAT_VERSION}")
+            feature_names = arrays["feature_names"]
+            return cls(
+                feature=arrays["feature"],
+                threshold=arrays["threshold"],
+                left=arrays["left"],
+                right=arrays["right"],
+                missing_left=arrays["missing_left"],
+                leaf_proba=arrays["leaf_proba"],
+                roots=arrays["roots"],
+                max_depth=arrays["max_depth"],
+                classes=arrays["classes"],
+                feature_names=feature_names.astype(object) if len(feature_names) else None,
+            )
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def apply(self, X) -> np.ndarray:
+        """Leaf index of every row in every tree, shape (n_samples, n_trees)."""
+        # sklearn validates X to float32 before comparing it against the float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        n_samples = X.shape[0]
+        nodes = np.tile(self.roots, n_samples)
+        sample_of = np.repeat(np.arange(n_samples), self.n_trees)
+
+        # only (row, tree) pairs that have not reached a leaf yet are walked further
+        active = np.arange(len(nodes))
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            internal = self.left[current] != current
+            if not internal.all():
+                active, current = active[internal], current[internal]
+                if not len(active):
+                    break
+            values = X[sample_of[active], self.feature[current]]
+            go_left = (values <= self.threshold[current]) | (np.isnan(values) & self.missing_left[current])
+            nodes[active] = np.where(go_left, self.left[current], self.right[current])
+        return nodes.reshape(n_samples, self.n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        per_tree = self.leaf_proba[self.apply(X)]
+        # cumsum adds tree by tree in order, like the forest's accumulation; np.sum would reorder
+        proba = per_tree.cumsum(axis=1, dtype=np.float64)[:, -1]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(self.predict_proba(X).argmax(axis=1))
+
+
+def parity_report(model, compiled: CompiledForest, X) -> dict:
+    """Compare sklearn's and the compiled forest's probabilities on the same rows."""
+    import pandas as pd
+
+    frame = pd.DataFrame(X, columns=model.feature_names_in_) if compiled.feature_names_in_ is not None else X
+    expected = model.predict_proba(frame)
+    actual = compiled.predict_proba(X)
+    mismatched = np.flatnonzero(np.any(expected != actual, axis=1))
+    return {
+        "rows": len(X),
+        "identical": bool(len(mismatched) == 0 and expected.dtype == actual.dtype),
+        "mismatched_rows": mismatched.tolist()[:20],
+        "max_abs_diff": float(np.max(np.abs(expected - actual))) if len(X) else 0.0,
+    }
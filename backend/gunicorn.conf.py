@@ -0,0 +1,42 @@
+"""Production server: gunicorn managing uvicorn workers, one process per core.
+
+    gunicorn main:app --config gunicorn.conf.py
+
+Single-row predictions are mostly Python and hold the GIL, so one process serves about one core.
+The app is imported and the model loaded once in the master, then the workers are forked from it
+and share the model's memory copy-on-write instead of each loading a copy. gc.freeze() keeps the
+collector from writing to those objects, which would unshare their pages.
+
+Everything else is per worker: the threadpool (THREADPOOL_SIZE), the database pool (DB_POOL_SIZE),
+the caches, the prediction job queue and /metrics. A model file replaced at runtime is reloaded by
+each worker separately, so it is no longer shared until the server is restarted.
+Gunicorn does not run on Windows; use uvicorn there (run-BE-App.bat).
+"""
+import gc
+import os
+
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY") or available_cores())
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    import main
+
+    try:
+        main.model_store.get()
+    except Exception as e:
+        server.log.warning("Model not preloaded, each worker loads it on first use: %s", e)
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,57 @@
+import csv
+import io
+from itertools import islice
+from openpyxl import load_workbook
+
+
+SUPPORTED_EXTENSIONS = (".csv", ".xlsx")
+
+
+def _clean(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _iter_csv_rows(file):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    header = [name.strip() for name in next(reader, [])]
+    for row_number, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        yield row_number, {name: _clean(value) for name, value in zip(header, row)}
+
+
+def _iter_xlsx_rows(file):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(name).strip() if name is not None else "" for name in next(rows, ())]
+        for row_number, row in enumerate(rows, start=2):
+            if all(cell is None for cell in row):
+                continue
+            yield row_number, {name: _clean(value) for name, value in zip(header, row)}
+    finally:
+        workbook.close()
+
+
+def _chunked(rows, chunk_size):
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_row_chunks(file, filename: str, chunk_size: int):
+    """Lazily split an uploaded CSV/XLSX file into lists of (row_number, row_dict) without reading it whole."""
+    name = (filename or "").lower()
+    if name.endswith(".xlsx"):
+        rows = _iter_xlsx_rows(file)
+    elif name.endswith(".csv"):
+        rows = _iter_csv_rows(file)
+    else:
+        raise ValueError(f"Unsupported file type, expected one of: {', '.join(SUPPORTED_EXTENSIONS)}")
+    return _chunked(rows, chunk_size)
@@ -0,0 +1,357 @@
+"""Prediction jobs: large inputs are spooled to disk and scored in batches by a local process pool.
+
+Every job is a directory under JOB_DIR holding the input, status.json and results.ndjson, so any
+API process on the host can report on it, and cancel it: a queued job of another process gets a
+`cancel` file, which the worker scoring it checks before it starts and between batches. The pool is per API process and bounded twice: at most
+`workers` jobs run at once and at most `max_queued` are queued or running, beyond which submissions
+are refused. Workers run at a lower CPU priority (`nice`), so interactive /predict keeps its latency.
+"""
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from pydantic import ValidationError
+
+FINISHED = ("done", "failed", "cancelled")
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+CANCEL_FILE = "cancel"
+
+# Windows API values used by _alive_windows
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+ERROR_ACCESS_DENIED = 5
+STILL_ACTIVE = 259
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+# --- worker process side ---
+
+_stores = {}
+
+
+def _init_worker(nice: int):
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+
+
+def _chunked(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_input(f, kind: str, batch_size: int):
+    """Chunks of (row, dict) pairs and a callable returning the fraction of the input read so far."""
+    if kind in ("csv", "xlsx"):
+        from importer import iter_row_chunks
+
+        total = os.fstat(f.fileno()).st_size
+        chunks = iter_row_chunks(f, f"input.{kind}", batch_size)
+        if kind == "xlsx":
+            # a zip archive, not read front to back
+            return chunks, lambda: None
+        # the reader's text wrapper closes the file once the last row is read
+        return chunks, lambda: 1.0 if f.closed or not total else f.tell() / total
+
+    if kind == "ndjson":
+        total = os.fstat(f.fileno()).st_size
+
+        def rows():
+            for line_no, line in enumerate(f):
+                if line.strip():
+                    try:
+                        yield line_no, json.loads(line)
+                    except ValueError as e:
+                        yield line_no, e
+        return _chunked(rows(), batch_size), lambda: f.tell() / total if total else 1.0
+
+    data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of samples")
+    done = [0]
+
+    def chunks():
+        for chunk in _chunked(enumerate(data), batch_size):
+            yield chunk
+            done[0] += len(chunk)
+    return chunks(), lambda: done[0] / len(data) if data else 1.0
+
+
+def run_job(job_dir: str, kind: str, model_path: str, batch_size: int, max_errors: int):
+    """Score the job's input into results.ndjson, one {"row", "prediction", "confidence"} object per line.
+
+    Rows that fail validation are skipped and reported in the status, like /samples/import does.
+    """
+    from model_store import ModelStore
+    from scoring import InputData, model_input, score, to_feature_array
+
+    status_path = os.path.join(job_dir, "status.json")
+    status = _read_json(status_path)
+    if _cancel_requested(job_dir):
+        _mark_cancelled(status_path, status)
+        return
+    store = _stores.get(model_path)
+    if store is None:
+        store = _stores[model_path] = ModelStore(model_path, check_interval=0, mmap_mode="r")
+    # ModelStore sets n_jobs=1: one core per job, the pool size decides how many the jobs use together
+    model, version = store.get()
+
+    status.update(status="running", started_at=time.time(), model_version=version, progress=0.0)
+    _write_json(status_path, status)
+
+    with open(os.path.join(job_dir, f"input.{kind}"), "rb") as f, \
+            open(os.path.join(job_dir, "results.ndjson.tmp"), "w") as out:
+        chunks, progress = _iter_input(f, kind, batch_size)
+        for chunk in chunks:
+            # a process that does not own the job may have asked to cancel it after it was picked up
+            if _cancel_requested(job_dir):
+                break
+            rows, samples = [], []
+            for row, value in chunk:
+                try:
+                    if isinstance(value, Exception):
+                        raise ValueError(f"Invalid JSON: {value}")
+                    samples.append(InputData.model_validate(value))
+                    rows.append(row)
+                except (ValidationError, ValueError) as e:
+                    status["rows_failed"] += 1
+                    if len(status["errors"]) < max_errors:
+                        details = e.errors(include_url=False, include_context=False) \
+                            if isinstance(e, ValidationError) else str(e)
+                        status["errors"].append({"row": row, "errors": details})
+
+            if samples:
+                predictions, confidences = score(model_input(to_feature_array(samples), model), model)
+                out.writelines(f'{{"row": {row}, "prediction": {int(p)}, "confidence": {float(100 * c)!r}}}\n'
+                               for row, p, c in zip(rows, predictions, confidences))
+            status["rows_done"] += len(samples)
+            status["progress"] = progress()
+            _write_json(status_path, status)
+
+    if _cancel_requested(job_dir):
+        os.remove(os.path.join(job_dir, "results.ndjson.tmp"))
+        _mark_cancelled(status_path, status)
+        return
+    os.replace(os.path.join(job_dir, "results.ndjson.tmp"), os.path.join(job_dir, "results.ndjson"))
+    status.update(status="done", finished_at=time.time(), progress=1.0)
+    _write_json(status_path, status)
+
+
+def _cancel_requested(job_dir: str) -> bool:
+    return os.path.exists(os.path.join(job_dir, CANCEL_FILE))
+
+
+def _mark_cancelled(status_path: str, status: dict):
+    status.update(status="cancelled", finished_at=time.time())
+    _write_json(status_path, status)
+
+
+# --- API process side ---
+
+class JobManager:
+    def __init__(self, directory: str, workers: int = 1, max_queued: int = 8, batch_size: int = 5000,
+                 max_errors: int = 1000, result_ttl: float = 3600, nice: int = 10):
+        self.directory = directory
+        self.workers = workers
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.result_ttl = result_ttl
+        self.nice = nice
+        self._executor = None
+        self._futures = {}  # queued or running jobs of this process, None while the input is uploaded
+        self._lock = threading.Lock()
+
+    def job_dir(self, job_id: str) -> str:
+        if not JOB_ID.fullmatch(job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.directory, job_id)
+
+    def reserve(self) -> str:
+        """A new job id and its empty directory, or JobQueueFull when the queue is at its limit."""
+        with self._lock:
+            if len(self._futures) >= self.max_queued:
+                raise JobQueueFull(f"{len(self._futures)} jobs are queued or running, try again later")
+            job_id = uuid.uuid4().hex
+            self._futures[job_id] = None
+        self._remove_expired()
+        os.makedirs(self.job_dir(job_id))
+        return job_id
+
+    def input_path(self, job_id: str, kind: str) -> str:
+        return os.path.join(self.job_dir(job_id), f"input.{kind}")
+
+    def discard(self, job_id: str):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def _pool(self):
+        if self._executor is None:
+            # spawned, not forked: the API process has threads (and maybe locks held) at this point
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker, initargs=(self.nice,))
+        return self._executor
+
+    def submit(self, job_id: str, kind: str, model_path: str) -> dict:
+        job_dir = self.job_dir(job_id)
+        status = {
+            "id": job_id,
+            "status": "queued",
+            "input": kind,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": None,
+            "rows_done": 0,
+            "rows_failed": 0,
+            "errors": [],
+            "owner_pid": os.getpid(),
+        }
+        _write_json(os.path.join(job_dir, "status.json"), status)
+        args = (run_job, job_dir, kind, model_path, self.batch_size, self.max_errors)
+        try:
+            future = self._pool().submit(*args)
+        except BrokenProcessPool:
+            self._executor = None
+            future = self._pool().submit(*args)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finished(job_id, f))
+        return _public(status)
+
+    def _finished(self, job_id: str, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or error is not None:
+            if isinstance(error, BrokenProcessPool):
+                self._executor = None
+            status_path = os.path.join(self.job_dir(job_id), "status.json")
+            try:
+                status = _read_json(status_path)
+            except FileNotFoundError:
+                return
+            status.update(status="cancelled" if future.cancelled() else "failed", finished_at=time.time(),
+                          error=None if error is None else f"{type(error).__name__}: {error}")
+            _write_json(status_path, status)
+
+    def _read_status(self, job_id: str) -> dict:
+        try:
+            status = _read_json(os.path.join(self.job_dir(job_id), "status.json"))
+        except FileNotFoundError:
+            raise KeyError(job_id)
+        if status["status"] not in FINISHED and not _alive(status["owner_pid"]):
+            status.update(status="failed", error="The API process running the job stopped")
+        elif status["status"] == "queued" and _cancel_requested(self.job_dir(job_id)):
+            status["status"] = "cancelled"
+        return status
+
+    def status(self, job_id: str) -> dict:
+        return _public(self._read_status(job_id))
+
+    def results_path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir(job_id), "results.ndjson")
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job or delete a finished one; False while it is running."""
+        status = self._read_status(job_id)
+        if status["status"] in FINISHED:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+            return True
+        if status["owner_pid"] == os.getpid():
+            future = self._futures.get(job_id)
+            return future is not None and future.cancel()
+        if status["status"] == "running":
+            return False
+        # queued in another API process: its worker finds the request when it picks the job up
+        with open(os.path.join(self.job_dir(job_id), CANCEL_FILE), "w"):
+            pass
+        return True
+
+    def _remove_expired(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+            return
+        now = time.time()
+        for job_id in os.listdir(self.directory):
+            try:
+                status = self._read_status(job_id)
+            except (KeyError, ValueError):
+                continue
+            if status["status"] in FINISHED and now - (status["finished_at"] or status["created_at"]) > self.result_ttl:
+                shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = sum(1 for future in self._futures.values() if future is not None and future.running())
+            return {"workers": self.workers, "max_queued": self.max_queued, "active": len(self._futures),
+                    "running": running}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _public(status: dict) -> dict:
+    # owner_pid is only for the API processes sharing JOB_DIR, clients get the rest
+    return {key: value for key, value in status.items() if key != "owner_pid"}
+
+
+def _alive(pid: int) -> bool:
+    if os.name == "nt":
+        # signal 0 is CTRL_C_EVENT on Windows, ask for the process's exit code instead
+        return _alive_windows(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _alive_windows(pid: int) -> bool:
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.GetExitCodeProcess.argtypes = [wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD)]
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # a process of another user can still be alive
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        exit_code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True
+        return exit_code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
@@ -0,0 +1,102 @@
+"""Drive a running backend with concurrent clients and report throughput and latency.
+
+    uvicorn main:app --port 8000
+    python loadtest.py --url http://localhost:8000 --path "/samples?limit=50" --concurrency 50 --duration 20
+    python loadtest.py --path /save-result --method POST --json '{"prediction": 0, "confidence": 90, "sample_type": "effluent", "date": "2024-01-01"}' --username demo --password demo
+
+Run it against two builds (e.g. before and after a change) with the same arguments to compare them.
+Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import httpx
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def login(client, username, password):
+    response = await client.post("/auth/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def worker(client, make_request, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.request(**make_request())
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(time.perf_counter() - start)
+
+
+def summarize(latencies, errors, elapsed, concurrency):
+    latencies = sorted(latencies)
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            name: round(value * 1000, 2) if value is not None else None
+            for name, value in [("mean", statistics.fmean(latencies) if latencies else None),
+                                ("p50", percentile(latencies, 0.50)),
+                                ("p95", percentile(latencies, 0.95)),
+                                ("p99", percentile(latencies, 0.99)),
+                                ("max", latencies[-1] if latencies else None)]
+        },
+    }
+
+
+async def measure(client, make_request, concurrency, duration):
+    """Run `concurrency` clients for `duration` seconds; make_request() returns client.request() arguments."""
+    latencies, errors = [], []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[worker(client, make_request, deadline, latencies, errors) for _ in range(concurrency)])
+    return summarize(latencies, len(errors), time.perf_counter() - start, concurrency)
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        headers = await login(client, args.username, args.password) if args.username else {}
+        request = {"method": args.method, "url": args.path, "headers": headers,
+                   "json": json.loads(args.json) if args.json else None}
+        report = await measure(client, lambda: request, args.concurrency, args.duration)
+    return {"path": args.path, "method": args.method, **report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/samples?limit=50")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--json", help="request body for POST/PUT")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--username", help="log in first and send the token with every request")
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
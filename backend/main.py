@@ -1,24 +1,89 @@
-from fastapi import FastAPI, Depends, HTTPException, Body, Query
-from pydantic import BaseModel
+from fastapi import FastAPI, Depends, HTTPException, Body, Query, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError, model_validator
 from datetime import date
-import joblib
-import pandas as pd
+import os
+import shutil
+import tempfile
 from fastapi.middleware.cors import CORSMiddleware
-from database import Base, engine, SessionLocal, SampleRecord, User
+import anyio.to_thread
+from database import SampleRecord, User
+from migrations import run_migrations
 from typing import List, Annotated
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Literal, Optional
 from starlette import status
 import auth
-from auth import get_current_user
-
+from auth import get_current_user, get_current_admin, get_db
+from importer import iter_row_chunks
+from queries import samples_query, sample_filters, parse_fields, encode_cursor, decode_cursor
+import exports
+from stats import sample_stats, rollup_stats, PARAMETERS, LEGAL_LIMITS
+import rollups
+import monitoring
+from model_store import ModelStore
+from prediction_cache import PredictionCache
+from jobs import JobManager, JobQueueFull
+from scoring import INPUT_FIELDS, InputData, model_input, score, to_feature_array
+from database import async_engine
+from logs import configure_logging, get_logger
+import metrics
+from metrics import Gauge, MetricsMiddleware, PREDICT_STAGES, Stopwatch
+
+configure_logging()
+logger = get_logger("main")
 
 app = FastAPI()
 app.include_router(auth.router)
 
-Base.metadata.create_all(bind=engine)
+for version, description in run_migrations():
+    logger.info("migration applied", extra={"version": version, "description": description})
+
+# "compiled" serves /predict from the array-based forest; batches stay on sklearn, which is faster for many rows
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "sklearn")
+
+# loaded on first use (or by /ready); MODEL_MMAP_MODE maps the arrays of the file, but for a pickled
+# sklearn forest that shares nothing between processes (see ModelStore), gunicorn's preload does
+model_store = ModelStore(os.getenv("MODEL_PATH", "model.pkl"),
+                         check_interval=float(os.getenv("MODEL_CHECK_INTERVAL", "2")),
+                         compile=INFERENCE_ENGINE == "compiled",
+                         mmap_mode=os.getenv("MODEL_MMAP_MODE", "r") or None)
+prediction_cache = PredictionCache(max_size=int(os.getenv("PREDICTION_CACHE_SIZE", "1024")),
+                                   ttl=float(os.getenv("PREDICTION_CACHE_TTL", "0")) or None,
+                                   decimals=int(os.getenv("PREDICTION_CACHE_DECIMALS", "4")))
+model_store.on_reload(prediction_cache.clear)
+prediction_jobs = JobManager(os.getenv("JOB_DIR") or os.path.join(tempfile.gettempdir(), "prediction-jobs"),
+                             workers=int(os.getenv("JOB_WORKERS", "1")),
+                             max_queued=int(os.getenv("JOB_QUEUE_DEPTH", "8")),
+                             batch_size=int(os.getenv("JOB_BATCH_SIZE", "5000")),
+                             result_ttl=float(os.getenv("JOB_RESULT_TTL", "3600")),
+                             nice=int(os.getenv("JOB_NICE", "10")))
+app.add_event_handler("shutdown", prediction_jobs.shutdown)
+
+# threads per worker process for sync endpoints and run_in_threadpool; anyio's default is 40
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "0"))
+
+
+def set_threadpool_size():
+    if THREADPOOL_SIZE:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+
+app.add_event_handler("startup", set_threadpool_size)
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+# a sample is about 200 bytes of JSON, this leaves room for whitespace and long decimals
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(MAX_BATCH_SIZE * 1024)))
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+MAX_IMPORT_ERRORS = 1000
+MAX_PAGE_SIZE = 1000
+MAX_JOB_BYTES = int(os.getenv("MAX_JOB_BYTES", str(200 * 2 ** 20)))
+JOB_RETRY_AFTER = 10
 
-model = joblib.load("model.pkl")
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,31 +94,42 @@ app.add_middleware(
     ],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, get_db]
+app.add_middleware(MetricsMiddleware)
+
+
+def pool_usage() -> dict:
+    pool = async_engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {}
+    # overflow() counts down from -pool_size until the pool is full
+    return {("size",): pool.size(), ("checked_out",): pool.checkedout(), ("idle",): pool.checkedin(),
+            ("overflow",): max(pool.overflow(), 0)}
+
+
+def cache_counts() -> dict:
+    counts = {}
+    for name, cache in (("prediction", prediction_cache), ("user", auth.user_cache)):
+        stats = cache.stats()
+        counts.update({(name, key): stats[key] for key in ("hits", "misses", "size")})
+    return counts
+
+
+Gauge("db_pool_connections", "Connections of the async engine's pool, by state.",
+      pool_usage, ("state",))
+Gauge("model_last_load_seconds", "Load time of the model currently served.", lambda: model_store.load_seconds)
+Gauge("model_loaded_timestamp_seconds", "When the model currently served was loaded.", lambda: model_store.loaded_at)
+Gauge("cache_entries", "Hits, misses and current size of the in-process caches.", cache_counts, ("cache", "kind"))
+Gauge("prediction_jobs", "Prediction jobs of this process, by state.",
+      lambda: {(state,): prediction_jobs.stats()[state] for state in ("active", "running")}, ("state",))
+Gauge("password_hash_pending", "bcrypt operations queued or running.", lambda: auth.password_hasher.stats()["pending"])
+Gauge("password_hash_rejected", "Logins and registrations turned away because the bcrypt queue was full.",
+      lambda: auth.password_hasher.stats()["rejected"])
+
+db_dependency = Annotated[AsyncSession, get_db]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
-class InputData(BaseModel):
-    Ammonium: Optional[float] = None
-    Phosphate: Optional[float] = None
-    COD: Optional[float] = None
-    BOD: Optional[float] = None
-    Conductivity: Optional[float] = None
-    PH: Optional[float] = None
-    Nitrogen: Optional[float] = None
-    Nitrate: Optional[float] = None
-    Turbidity: Optional[float] = None
-    TSS: Optional[float] = None
-
-
 class SaveSampleData(InputData):
     prediction: int
     confidence: float
@@ -61,6 +137,18 @@ class SaveSampleData(InputData):
     date: date
 
 
+class ImportSampleData(SaveSampleData):
+    prediction: Optional[int] = None
+    confidence: Optional[float] = None
+
+    @model_validator(mode="after")
+    def scored_or_unscored(self):
+        # a confidence belongs to its prediction: scoring one half would overwrite or mismatch the other
+        if (self.prediction is None) != (self.confidence is None):
+            raise ValueError("prediction and confidence must be given together or both left empty")
+        return self
+
+
 class SampleSummary(BaseModel):
     id: int
     Ammonium: Optional[float] = None
@@ -91,85 +179,428 @@ class UserOut(BaseModel):
 
 
 @app.get("/", status_code=status.HTTP_200_OK, response_model=None)
-async def user(user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+async def user(user: dict = Depends(get_current_user)):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
     return {"User": user}
 
 
+@app.get("/ready")
+def ready():
+    try:
+        model_store.get()
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Model not loaded: {e}")
+    return model_store.status()
+
+
+@app.post("/admin/model/reload")
+def reload_model(force: bool = Query(False, description="Reload even if the file did not change"),
+                 admin: dict = Depends(get_current_admin)):
+    try:
+        model_store.load(force=force)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Reload failed, still serving the previous model: {e}")
+    return model_store.status()
+
+
 @app.get("/users", response_model=List[UserOut])
-def list_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
-    return users
+async def list_users(db: AsyncSession = Depends(get_db)):
+    users = await db.scalars(select(User))
+    return users.all()
+
+
+def parse_batch(body: bytes, content_type: str) -> List[InputData]:
+    if "ndjson" in content_type or "jsonl" in content_type:
+        samples, errors = [], []
+        for line_no, line in enumerate(body.splitlines()):
+            if not line.strip():
+                continue
+            try:
+                samples.append(InputData.model_validate_json(line))
+            except ValidationError as e:
+                errors.extend({**err, "loc": ("body", line_no, *err["loc"])} for err in e.errors(include_url=False))
+        if errors:
+            raise RequestValidationError(errors)
+        return samples
 
+    try:
+        return TypeAdapter(List[InputData]).validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)])
+
+
+def predict_one(data: InputData) -> dict:
+    model, version = model_store.get()
+    values = to_feature_array([data])
+
+    key = prediction_cache.key(version, values[0].tolist()) if prediction_cache.enabled else None
+    result = prediction_cache.get(key) if key else None
+    if result is None:
+        stopwatch = Stopwatch()
+        model = model_store.compiled or model
+        features = model_input(values, model)
+        PREDICT_STAGES.observe(stopwatch.lap(), "frame")
+        predictions, confidences = score(features, model)
+        PREDICT_STAGES.observe(stopwatch.lap(), "inference")
+        result = {"prediction": int(predictions[0]),"confidence": float(100 * confidences[0])}
+        if key:
+            prediction_cache.put(key, result)
+
+    return dict(result)
+
+
+# the body is validated here instead of by FastAPI, so that the stage can be timed
+@app.post("/predict", openapi_extra={"requestBody": {"required": True, "content": {
+    "application/json": {"schema": {"$ref": "#/components/schemas/InputData"}},
+}}})
+async def predict(request: Request):
+    body = await request.body()
+    stopwatch = Stopwatch()
+    try:
+        data = InputData.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)])
+    PREDICT_STAGES.observe(stopwatch.lap(), "validation")
 
-@app.post("/predict")
-def predict(data: InputData):
-    values = [[data.Ammonium, data.Phosphate, data.COD, data.BOD, data.Conductivity, data.PH, data.Nitrogen, data.Nitrate, data.Turbidity, data.TSS]]
-    columns = ["Ammonium (mg/l N)", "Ortho Phosphate (mg/l P)", "COD (mg/l O2)" ,"BOD (mg/l O2)", "Conductivity (mS/m)", "pH", "Nitrogen Total (mg/l N)", "Nitrate (mg/l NO3)", "Turbidity (NTU)", "TSS (mg/l)"]
+    result = await run_in_threadpool(predict_one, data)
 
-    df = pd.DataFrame(values, columns=columns)
-    prediction = model.predict(df)[0]
-    proba = model.predict_proba(df)[0]
-    print(prediction, proba)
+    stopwatch.lap()
+    response = JSONResponse(result)
+    PREDICT_STAGES.observe(stopwatch.lap(), "serialization")
+    return response
 
-    confidence = proba[int(prediction)]
 
-    return {"prediction": int(prediction),"confidence": float(100 * confidence)}
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
+@app.get("/predict/cache")
+def prediction_cache_stats():
+    return {**prediction_cache.stats(), "model_version": model_store.get()[1]}
 
-@app.post("/save-result", response_model=None)
-def save(data: SaveSampleData = Body(...), 
-        db: Session = Depends(get_db),
-        user: dict = Depends(get_current_user)
-        ):
-    
-    db_record = SampleRecord(
-        Ammonium=data.Ammonium, 
-        Phosphate=data.Phosphate, 
-        COD=data.COD, 
-        BOD=data.BOD, 
-        Conductivity=data.Conductivity, 
-        PH=data.PH, 
-        Nitrogen=data.Nitrogen, 
-        Nitrate=data.Nitrate, 
-        Turbidity=data.Turbidity, 
-        TSS=data.TSS, 
-        prediction=data.prediction, 
+
+BATCH_BODY_SCHEMA = {"type": "array", "items": {"$ref": "#/components/schemas/InputData"}}
+
+
+@app.post("/predict/batch", openapi_extra={"requestBody": {"required": True, "content": {
+    "application/json": {"schema": BATCH_BODY_SCHEMA},
+    "application/x-ndjson": {"schema": {"$ref": "#/components/schemas/InputData"}},
+}}})
+async def predict_batch(request: Request):
+    too_large = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                              detail=f"Batch size is limited to {MAX_BATCH_SIZE} samples")
+    # reject oversized batches before reading, or at least before parsing them
+    if int(request.headers.get("content-length") or 0) > MAX_BATCH_BYTES:
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_BATCH_BYTES:
+            raise too_large
+    # one object per sample in both formats, InputData has no nested ones
+    if body.count(b"{") > MAX_BATCH_SIZE:
+        raise too_large
+
+    # validation costs about as much as scoring, neither runs on the event loop
+    samples = await run_in_threadpool(parse_batch, bytes(body), request.headers.get("content-type", ""))
+    if not samples:
+        return []
+
+    model, _ = model_store.get()
+    predictions, confidences = await run_in_threadpool(lambda: score(model_input(to_feature_array(samples), model), model))
+
+    return [{"prediction": int(p), "confidence": float(100 * c)} for p, c in zip(predictions, confidences)]
+
+
+async def spool_body(request: Request, path: str, max_bytes: int):
+    size = 0
+    with open(path, "wb") as f:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                    detail=f"Job input is limited to {max_bytes} bytes")
+            f.write(chunk)
+
+
+def job_status(job_id: str) -> dict:
+    try:
+        job = prediction_jobs.status(job_id)
+    except KeyError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if job["status"] == "done":
+        job["results_url"] = f"/predict/jobs/{job_id}/results"
+    return job
+
+
+@app.post("/predict/jobs", status_code=status.HTTP_202_ACCEPTED, openapi_extra={"requestBody": {"required": True, "content": {
+    "application/json": {"schema": BATCH_BODY_SCHEMA},
+    "application/x-ndjson": {"schema": {"$ref": "#/components/schemas/InputData"}},
+    "multipart/form-data": {"schema": {"type": "object", "properties": {
+        "file": {"type": "string", "format": "binary", "description": "CSV or XLSX with the InputData columns"}}}},
+}}})
+async def create_prediction_job(request: Request):
+    try:
+        model_store.get()
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Model not loaded: {e}")
+    try:
+        job_id = await run_in_threadpool(prediction_jobs.reserve)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e),
+                            headers={"Retry-After": str(JOB_RETRY_AFTER)})
+
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form(max_files=1)
+            upload = form.get("file")
+            kind = os.path.splitext(getattr(upload, "filename", None) or "")[1].lower().lstrip(".")
+            if kind not in ("csv", "xlsx"):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail="Expected a CSV or XLSX file in the 'file' field")
+            if upload.size is not None and upload.size > MAX_JOB_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                    detail=f"Job input is limited to {MAX_JOB_BYTES} bytes")
+
+            def copy_upload():
+                with open(prediction_jobs.input_path(job_id, kind), "wb") as f:
+                    shutil.copyfileobj(upload.file, f)
+            await run_in_threadpool(copy_upload)
+        else:
+            kind = "ndjson" if "ndjson" in content_type or "jsonl" in content_type else "json"
+            await spool_body(request, prediction_jobs.input_path(job_id, kind), MAX_JOB_BYTES)
+    except BaseException:
+        await run_in_threadpool(prediction_jobs.discard, job_id)
+        raise
+
+    job = await run_in_threadpool(prediction_jobs.submit, job_id, kind, model_store.path)
+    return JSONResponse(job, status_code=status.HTTP_202_ACCEPTED, headers={"Location": f"/predict/jobs/{job_id}"})
+
+
+@app.get("/predict/jobs/{job_id}")
+def get_prediction_job(job_id: str):
+    return job_status(job_id)
+
+
+@app.get("/predict/jobs/{job_id}/results", response_model=None)
+def get_prediction_job_results(job_id: str):
+    job = job_status(job_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job['status']}")
+    return FileResponse(prediction_jobs.results_path(job_id), media_type="application/x-ndjson",
+                        filename=f"predictions-{job_id}.ndjson")
+
+
+@app.delete("/predict/jobs/{job_id}")
+def delete_prediction_job(job_id: str):
+    job_status(job_id)
+    if not prediction_jobs.cancel(job_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job is already running")
+    return {"detail": "Job cancelled or deleted"}
+
+
+
+def to_sample_row(data: SaveSampleData, user_id: int) -> dict:
+    row = {field: getattr(data, field) for field in INPUT_FIELDS}
+    row.update(
+        prediction=data.prediction,
         confidence=data.confidence,
         sample_type=data.sample_type,
         timestamp=data.date,
-        user_id=user["id"]
+        user_id=user_id,
     )
+    return row
+
+
+@app.post("/save-result", response_model=None)
+async def save(data: SaveSampleData = Body(...), 
+        db: AsyncSession = Depends(get_db),
+        user: dict = Depends(get_current_user)
+        ):
+    
+    row = to_sample_row(data, user["id"])
+    db_record = SampleRecord(**row)
 
     db.add(db_record)
-    db.commit()
-    db.refresh(db_record)
+    await db.flush()
+    await db.run_sync(rollups.add_samples, [row])
+    # the drift statistics last: their rows are shared by every save, see monitoring.py
+    await db.run_sync(monitoring.add_samples, [row])
+    await db.commit()
     return {"message": "Saved successfully"}
 
 
+def prepare_import_chunk(chunk, user_id: int, score_missing: bool, errors: list) -> List[dict]:
+    samples = []
+    for row_number, row in chunk:
+        try:
+            samples.append(ImportSampleData.model_validate(row))
+        except ValidationError as e:
+            if len(errors) < MAX_IMPORT_ERRORS:
+                errors.append({"row": row_number, "errors": e.errors(include_url=False, include_context=False)})
+
+    rows = [to_sample_row(sample, user_id) for sample in samples]
+    unscored = [i for i, sample in enumerate(samples) if sample.prediction is None]
+    if unscored and score_missing:
+        model = model_store.get()[0]
+        predictions, confidences = score(model_input(to_feature_array([samples[i] for i in unscored]), model), model)
+        for i, prediction, confidence in zip(unscored, predictions, confidences):
+            rows[i]["prediction"] = int(prediction)
+            rows[i]["confidence"] = float(100 * confidence)
+    else:
+        for i in unscored:
+            rows[i]["prediction"] = -1
+            rows[i]["confidence"] = -1
+    return rows
+
+
+@app.post("/samples/import", response_model=None)
+async def import_samples(file: UploadFile = File(...),
+                         score_missing: bool = Query(False, description="Score rows without a prediction using the loaded model"),
+                         chunk_size: int = Query(IMPORT_CHUNK_SIZE, ge=1, le=50_000),
+                         db: AsyncSession = Depends(get_db),
+                         user: dict = Depends(get_current_user)
+                         ):
+    try:
+        chunks = await run_in_threadpool(iter_row_chunks, file.file, file.filename, chunk_size)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    progress, errors = [], []
+    total_rows = total_inserted = 0
+
+    # file parsing, validation and scoring run in the threadpool, only the inserts run on the loop
+    chunk_no = 0
+    while (chunk := await run_in_threadpool(next, chunks, None)) is not None:
+        rows = await run_in_threadpool(prepare_import_chunk, chunk, user["id"], score_missing, errors)
+        if rows:
+            await db.execute(insert(SampleRecord), rows)
+            await db.run_sync(rollups.add_samples, rows)
+            await db.run_sync(monitoring.add_samples, rows)
+            await db.commit()
+
+        total_rows += len(chunk)
+        total_inserted += len(rows)
+        progress.append({"chunk": chunk_no, "rows": len(chunk), "inserted": len(rows), "failed": len(chunk) - len(rows)})
+        chunk_no += 1
+
+    return {
+        "message": f"Imported {total_inserted} of {total_rows} rows",
+        "rows": total_rows,
+        "inserted": total_inserted,
+        "failed": total_rows - total_inserted,
+        "chunks": progress,
+        "errors": errors,
+    }
+
+
 
 @app.get("/samples", response_model=List[SampleSummary])
-def get_all_samples(db: Session = Depends(get_db),
+async def get_all_samples(response: Response,
+                    db: AsyncSession = Depends(get_db),
                     sample_type: Optional[str] = Query(None, description="Filter by sample type"),
-                    user_id: Optional[int] = None
+                    user_id: Optional[int] = None,
+                    date_from: Optional[date] = None,
+                    date_to: Optional[date] = None,
+                    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size, all samples when omitted"),
+                    cursor: Optional[str] = Query(None, description="X-Next-Cursor value of the previous page"),
+                    fields: Optional[str] = Query(None, description="Comma-separated columns to return")
                     ):
-    query = db.query(SampleRecord)
-    if user_id:
-        query = query.filter(SampleRecord.user_id == user_id)
-    if sample_type and sample_type != 'all':
-        query = query.filter(SampleRecord.sample_type == sample_type)
-    
-    samples = query.order_by(SampleRecord.timestamp.desc()).all()
-    
+    try:
+        columns = parse_fields(fields)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    def fetch(session):
+        query = samples_query(session, user_id=user_id, sample_type=sample_type, after=after, columns=columns,
+                              date_from=date_from, date_to=date_to)
+        return (query.limit(limit + 1) if limit else query).all()
+
+    samples = await db.run_sync(fetch)
+    headers = {}
+    if limit and len(samples) > limit:
+        samples = samples[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(samples[-1].timestamp, samples[-1].id)
+
+    if columns:
+        return JSONResponse(jsonable_encoder([sample._asdict() for sample in samples]), headers=headers)
+    response.headers.update(headers)
     return samples
 
 
 
+@app.get("/samples/stats", response_model=None)
+async def get_sample_stats(db: AsyncSession = Depends(get_db),
+                     bucket: Literal["day", "week", "month"] = "day",
+                     sample_type: Optional[str] = Query(None, description="Filter by sample type"),
+                     user_id: Optional[int] = None,
+                     date_from: Optional[date] = None,
+                     date_to: Optional[date] = None,
+                     parameters: Optional[str] = Query(None, description="Comma-separated parameters, all when omitted"),
+                     group_by_user: bool = False,
+                     percentiles: bool = Query(True, description="Percentiles need the raw samples, without them the daily rollups are read")
+                     ):
+    selected = [p.strip() for p in parameters.split(",") if p.strip()] if parameters else PARAMETERS
+    unknown = [p for p in selected if p not in PARAMETERS]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown parameters: {', '.join(unknown)}")
+
+    with_percentiles = percentiles and db.bind.dialect.name == "postgresql"
+    aggregate = sample_stats if with_percentiles else rollup_stats
+    series = await db.run_sync(aggregate, bucket, parameters=selected, sample_type=sample_type, user_id=user_id,
+                       date_from=date_from, date_to=date_to, group_by_user=group_by_user)
+
+    return {
+        "bucket": bucket,
+        "limits": {p: {"min": LEGAL_LIMITS[p][0], "max": LEGAL_LIMITS[p][1]} for p in selected},
+        "series": series,
+    }
+
+
+
+@app.get("/samples/drift", response_model=None)
+async def get_sample_drift(db: AsyncSession = Depends(get_db),
+                           sample_type: Optional[str] = Query(None, description="One sample type, all samples when omitted")):
+    # the reference imports the training scripts the first time, off the event loop
+    reference = await run_in_threadpool(monitoring.training_reference)
+    return await db.run_sync(monitoring.summary, sample_type, reference)
+
+
+
+@app.get("/samples/export", response_model=None)
+async def export_samples(request: Request,
+                         db: AsyncSession = Depends(get_db),
+                         format: Literal["csv", "xlsx", "parquet"] = "csv",
+                         sample_type: Optional[str] = Query(None, description="Filter by sample type"),
+                         user_id: Optional[int] = None,
+                         date_from: Optional[date] = None,
+                         date_to: Optional[date] = None,
+                         filename: str = Query("samples", max_length=100, description="Download name, without extension")
+                         ):
+    filters = sample_filters(user_id=user_id, sample_type=sample_type, date_from=date_from, date_to=date_to)
+    etag = await exports.export_etag(db, format, filters)
+    headers = {"ETag": etag, "Content-Disposition": exports.content_disposition(filename, format)}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    statement = exports.export_statement(filters)
+    media_type = exports.MEDIA_TYPES[format]
+    # ranges need the finished file; xlsx is a zip archive and cannot be written as a stream
+    if format == "xlsx" or "range" in request.headers:
+        path = await exports.export_file(statement, format, etag)
+        return FileResponse(path, media_type=media_type, headers=headers)
+    return StreamingResponse(exports.stream_export(statement, format), media_type=media_type, headers=headers)
+
+
+
 @app.get("/samples/{sample_id}", response_model=SampleSummary)
-def get_sample(sample_id: int, db: Session = Depends(get_db)):
-    sample = db.query(SampleRecord).filter(SampleRecord.id == sample_id).first()
+async def get_sample(sample_id: int, db: AsyncSession = Depends(get_db)):
+    sample = await db.get(SampleRecord, sample_id)
     if not sample:
         raise HTTPException(status_code=404, detail="Sample not found")
     return sample
@@ -177,18 +608,20 @@ def get_sample(sample_id: int, db: Session = Depends(get_db)):
 
 
 @app.delete("/samples/{sample_id}", response_model=None)
-def delete_record(sample_id: int,
-                  db: Session = Depends(get_db), 
+async def delete_record(sample_id: int,
+                  db: AsyncSession = Depends(get_db), 
                   current_user: dict = Depends(get_current_user)
                   ):
-    record = db.query(SampleRecord).filter(SampleRecord.id == sample_id).first()
+    record = await db.get(SampleRecord, sample_id)
     if not record:
         raise HTTPException(status_code=404, detail="Sample not found")
 
     if record.user_id != current_user['id']:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this sample")
 
-    db.delete(record)
-    db.commit()
+    await db.delete(record)
+    await db.flush()
+    await db.run_sync(rollups.remove_sample, record)
+    await db.commit()
 
     return {"message": f"Sample with id {sample_id} has been deleted"}
\ No newline at end of file
@@ -0,0 +1,72 @@
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, select, text
+from database import Base, engine, SampleRecord, SampleDailyRollup, SampleDriftStats
+import monitoring
+import rollups
+
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _initial_schema(connection):
+    Base.metadata.create_all(bind=connection)
+
+
+def _samples_access_path_indexes(connection):
+    for index in SampleRecord.__table__.indexes:
+        index.create(bind=connection, checkfirst=True)
+
+
+def _sample_daily_rollups(connection):
+    SampleDailyRollup.__table__.create(bind=connection, checkfirst=True)
+    rollups.rebuild(connection)
+
+
+def _sample_drift_stats(connection):
+    SampleDriftStats.__table__.create(bind=connection, checkfirst=True)
+    monitoring.rebuild(connection)
+
+
+# append only: every step must be idempotent, because databases created before this
+# module existed already have some of the objects
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "composite indexes on samples for /samples access paths", _samples_access_path_indexes),
+    (3, "daily sample rollups", _sample_daily_rollups),
+    (4, "sample drift statistics", _sample_drift_stats),
+]
+
+
+def run_migrations(bind=engine):
+    applied_now = []
+    with bind.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # serialize concurrent startups of several workers
+            connection.execute(text("SELECT pg_advisory_xact_lock(884201)"))
+        metadata.create_all(bind=connection)
+        applied = set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+        for version, description, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            migrate(connection)
+            connection.execute(insert(schema_migrations).values(
+                version=version, description=description, applied_at=datetime.utcnow()))
+            applied_now.append((version, description))
+    return applied_now
+
+
+if __name__ == "__main__":
+    applied = run_migrations()
+    for version, description in applied:
+        print(f"Applied {version:04d}: {description}")
+    if not applied:
+        print("Schema is up to date")
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+import joblib
+from forest_engine import CompiledForest
+from logs import get_logger
+from metrics import Histogram
+
+logger = get_logger("model")
+MODEL_LOAD = Histogram("model_load_duration_seconds", "Time to load (and compile) a model file.",
+                       buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+
+class ModelStore:
+    """Holds the loaded model and reloads it when the file on disk is replaced.
+
+    Nothing is read until the first get()/load(), so importing the app stays cheap.
+    The file is stat()-ed at most once per `check_interval` seconds, so the check
+    stays off the per-request cost. The version string changes with every new file.
+    With `compile=True` an array-based copy of the forest is kept next to the model.
+
+    A `.npz` path is a compact export (see CompiledForest.load) and is served as is.
+
+    `mmap_mode` alone shares nothing for a pickled sklearn model: sklearn copies its tree
+    nodes into every process when the forest is unpickled, mapped or not. It only shares the
+    compiled arrays (INFERENCE_ENGINE=compiled), which are cached next to the model file for
+    that reason, and the sklearn copy stays in every process next to them. A compressed
+    `.npz` is not mapped either, it is just ~15x smaller. Processes share one copy of the
+    model when they are forked after loading it (gunicorn.conf.py preloads it).
+    """
+
+    def __init__(self, path: str, check_interval: float = 2.0, compile: bool = False,
+                 mmap_mode: Optional[str] = None):
+        self.path = path
+        self.check_interval = check_interval
+        self.compile = compile
+        self.mmap_mode = mmap_mode
+        self._current = (None, None, None)  # (model, version, compiled), swapped as one reference
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.load_seconds = None
+        self.loaded_at = None
+
+    def on_reload(self, callback):
+        self._listeners.append(callback)
+
+    @property
+    def ready(self) -> bool:
+        return self._current[0] is not None
+
+    @property
+    def compact(self) -> bool:
+        return self.path.endswith(".npz")
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._current[1]
+
+    def _signature(self) -> str:
+        stat = os.stat(self.path)
+        return f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+
+    def _load_compiled(self, model, signature: str) -> CompiledForest:
+        cache_path = f"{self.path}.compiled"
+        if os.path.exists(cache_path):
+            cached = joblib.load(cache_path, mmap_mode=self.mmap_mode)
+            if cached["source_version"] == signature:
+                return cached["forest"]
+
+        forest = CompiledForest.from_sklearn(model)
+        if self.mmap_mode:
+            # write-then-rename, so other workers never map a half written file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)))
+            os.close(fd)
+            joblib.dump({"source_version": signature, "forest": forest}, tmp_path)
+            os.replace(tmp_path, cache_path)
+            forest = joblib.load(cache_path, mmap_mode=self.mmap_mode)["forest"]
+        return forest
+
+    def load(self, force: bool = False):
+        """Load the current file if it changed (or always with force) and swap it in atomically."""
+        with self._lock:
+            signature = self._signature()
+            if force or signature != self._current[1]:
+                start = time.perf_counter()
+                if self.compact:
+                    # already an array-based forest, there is nothing to compile
+                    model, compiled = CompiledForest.load(self.path), None
+                else:
+                    model = joblib.load(self.path, mmap_mode=self.mmap_mode)
+                    if hasattr(model, "n_jobs"):
+                        # models saved with n_jobs=-1 would fan every prediction out over all cores,
+                        # in every worker process
+                        model.n_jobs = 1
+                    compiled = self._load_compiled(model, signature) if self.compile else None
+                # requests keep using the previous model until this single assignment
+                self._current = (model, signature, compiled)
+                self.load_seconds = time.perf_counter() - start
+                self.loaded_at = time.time()
+                MODEL_LOAD.observe(self.load_seconds)
+                logger.info("model loaded", extra={"path": self.path, "version": signature,
+                                                   "load_seconds": round(self.load_seconds, 4),
+                                                   "format": "compact" if self.compact else "pickle",
+                                                   "compiled": compiled is not None})
+                for callback in self._listeners:
+                    callback()
+            self._checked_at = time.monotonic()
+        return self._current[:2]
+
+    @property
+    def compiled(self):
+        return self._current[2]
+
+    def get(self):
+        model, version, _ = self._current
+        if model is None or time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            try:
+                if self._signature() != version:
+                    return self.load()
+            except Exception as e:
+                # removed, half written or corrupt: keep serving the model we have
+                if model is None:
+                    raise
+                logger.warning("model reload failed, serving the previous model",
+                               extra={"path": self.path, "version": version, "error": f"{type(e).__name__}: {e}"})
+        return model, version
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "path": self.path,
+            "version": self.version,
+            "compiled": self.compiled is not None or self.compact,
+            "format": "compact" if self.compact else "pickle",
+            "mmap_mode": self.mmap_mode,
+            "load_seconds": self.load_seconds,
+            "loaded_at": self.loaded_at,
+        }
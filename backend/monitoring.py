@@ -0,0 +1,283 @@
+"""Drift and exceedance monitoring of the saved samples, updated incrementally.
+
+For every parameter, plus the prediction and its confidence, sample_drift_stats keeps exponentially
+weighted sums over the stream of saved samples: of the weight, the value, its square, the near-limit
+and exceedance indicators and a histogram over the legal range. Scope '*' covers all samples, the
+other scopes one sample_type each. Adding a sample decays a row by (1 - alpha) and adds the sample
+with weight alpha, so the cost per sample does not depend on the size of the table, and a sample
+counts half as much after DRIFT_HALF_LIFE newer ones. add_samples() folds a batch into one UPDATE
+per row, in the same transaction as the inserts, like the rollups.
+
+The price is contention: every save updates the same 12 rows of scope '*' (and of its sample_type),
+so on Postgres concurrent saves queue on those row locks until the saving transaction commits. The
+save endpoints therefore fold the statistics last, right before the commit, which keeps the wait to
+one UPDATE and the commit. Batches (/samples/import) pay it once per chunk, not once per sample.
+
+summary() turns a scope into means, standard deviations, rates and a population stability index
+(PSI) against the distribution the model is trained on: generate_dataset in datasetGeneration, which
+draws every parameter independently from `ranges`. Deleted samples stay in the statistics; run this
+module to rebuild them from the table, replayed in insertion order:
+
+    python monitoring.py rebuild
+"""
+import math
+import os
+import sys
+from functools import lru_cache
+from typing import Optional
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from database import SampleDriftStats, SampleRecord
+from stats import PARAMETERS, LEGAL_LIMITS, is_exceedance
+
+TRAINING_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_training_scripts")
+
+DRIFT_HALF_LIFE = float(os.getenv("DRIFT_HALF_LIFE", "1000"))  # samples
+# scopes with fewer samples than this are reported, but not classified as drifting or stable
+DRIFT_MIN_SAMPLES = int(os.getenv("DRIFT_MIN_SAMPLES", "100"))
+ALPHA = 1 - 0.5 ** (1 / DRIFT_HALF_LIFE)
+
+ALL_SCOPE = "*"
+SCORE_COLUMNS = ["prediction", "confidence"]
+MONITORED = PARAMETERS + SCORE_COLUMNS
+
+# the top 20% of a range is near its limit: 1 - near_limit_coefficient in datasetGeneration, which
+# training_reference() checks, the backend does not import the training scripts otherwise
+NEAR_LIMIT_FRACTION = 0.2
+BINS = 10
+BIN_COLUMNS = [f"bin_{i}" for i in range(BINS + 2)]
+EWM_COLUMNS = ["ewm_weight", "ewm_sum", "ewm_sum_sq", "ewm_near_limit", "ewm_exceed", *BIN_COLUMNS]
+# usual PSI reading: below 0.1 no shift, up to 0.25 a moderate one, above that a significant one
+PSI_LEVELS = ((0.1, "stable"), (0.25, "moderate"))
+PSI_FLOOR = 1e-4
+
+drift = SampleDriftStats.__table__
+
+
+def _bounds(parameter: str):
+    if parameter == "prediction":
+        return 0.0, 1.0
+    if parameter == "confidence":
+        return 50.0, 100.0
+    low, high = LEGAL_LIMITS[parameter]
+    return low or 0.0, high
+
+
+def _near_limit_low(parameter: str) -> float:
+    low, high = _bounds(parameter)
+    # ranges from 0 scale the limit, the others the width of the range (datasetGeneration.parameter_bounds)
+    return high * (1 - NEAR_LIMIT_FRACTION) if low == 0 else high - (high - low) * NEAR_LIMIT_FRACTION
+
+
+def _bin(value: float, low: float, high: float) -> int:
+    if value < low:
+        return 0
+    if value > high:
+        return BINS + 1
+    return 1 + min(int((value - low) / (high - low) * BINS), BINS - 1)
+
+
+def _dialect(db):
+    return db.get_bind().dialect.name if hasattr(db, "get_bind") else db.dialect.name
+
+
+def _deltas(rows) -> list:
+    """Per (scope, parameter): the number of values, and what the UPDATE adds after decaying the row."""
+    values = {}
+    for row in rows:
+        scored = row.get("prediction") is not None and row["prediction"] >= 0
+        scopes = (ALL_SCOPE, row["sample_type"]) if row.get("sample_type") else (ALL_SCOPE,)
+        for parameter in MONITORED:
+            value = row.get(parameter)
+            if value is None or (parameter in SCORE_COLUMNS and not scored):
+                continue
+            for scope in scopes:
+                values.setdefault((scope, parameter), []).append(float(value))
+
+    deltas = []
+    # in key order, so concurrent saves lock the rows they share in the same order instead of deadlocking
+    for (scope, parameter), xs in sorted(values.items()):
+        low, high = _bounds(parameter)
+        near_low = _near_limit_low(parameter)
+        sums = dict.fromkeys(EWM_COLUMNS, 0.0)
+        for age, x in enumerate(reversed(xs)):
+            weight = ALPHA * (1 - ALPHA) ** age
+            sums["ewm_weight"] += weight
+            sums["ewm_sum"] += weight * x
+            sums["ewm_sum_sq"] += weight * x * x
+            sums[BIN_COLUMNS[_bin(x, low, high)]] += weight
+            if parameter in LEGAL_LIMITS:
+                if near_low <= x <= high:
+                    sums["ewm_near_limit"] += weight
+                if is_exceedance(x, parameter):
+                    sums["ewm_exceed"] += weight
+        deltas.append({"key_scope": scope, "key_parameter": parameter, "add_count": len(xs),
+                       "decay": (1 - ALPHA) ** len(xs), **{f"add_{name}": sums[name] for name in EWM_COLUMNS}})
+    return deltas
+
+
+# built once: constructing the expressions costs more than running them on every save
+_CREATE_ROWS = {
+    "postgresql": postgresql.insert(drift).on_conflict_do_nothing(index_elements=["scope", "parameter"]),
+    "sqlite": sqlite.insert(drift).on_conflict_do_nothing(index_elements=["scope", "parameter"]),
+}
+_FOLD = (
+    update(drift)
+    .where(drift.c.scope == bindparam("key_scope"), drift.c.parameter == bindparam("key_parameter"))
+    .values(value_count=drift.c.value_count + bindparam("add_count"),
+            **{name: drift.c[name] * bindparam("decay") + bindparam(f"add_{name}") for name in EWM_COLUMNS})
+)
+
+
+def add_samples(db, rows):
+    """Fold freshly inserted sample rows (dicts with SampleRecord columns), in order, into the statistics."""
+    deltas = _deltas(rows)
+    if not deltas:
+        return
+
+    dialect = _dialect(db)
+    if dialect not in _CREATE_ROWS:
+        raise ValueError(f"Drift statistics are not supported on {dialect}")
+    db.execute(_CREATE_ROWS[dialect], [{"scope": d["key_scope"], "parameter": d["key_parameter"]} for d in deltas])
+    db.execute(_FOLD, deltas)
+
+
+def rebuild(db, chunk_size: int = 10_000):
+    db.execute(delete(drift))
+    columns = [getattr(SampleRecord, name) for name in ["id", *MONITORED, "sample_type"]]
+    last_id = 0
+    while True:
+        rows = [dict(row._mapping) for row in db.execute(
+            select(*columns).where(SampleRecord.id > last_id).order_by(SampleRecord.id).limit(chunk_size))]
+        if not rows:
+            return
+        add_samples(db, rows)
+        last_id = rows[-1]["id"]
+
+
+def _uniform_overlap(a: float, b: float, low: float, high: float) -> float:
+    """Probability that Uniform(a, b) falls in [low, high]."""
+    return max(0.0, min(b, high) - max(a, low)) / (b - a)
+
+
+@lru_cache(maxsize=1)
+def training_reference() -> Optional[dict]:
+    """Mean, std, near-limit and exceedance rates and histogram of every parameter in the training data.
+
+    Computed from generate_dataset's definition: every parameter is uniform on its regular range,
+    or on its near-limit range for the near-limit rows that picked it. None when the training
+    scripts are not deployed next to the backend.
+    """
+    if TRAINING_DIR not in sys.path:
+        sys.path.append(TRAINING_DIR)
+    try:
+        import datasetGeneration as generation
+    except ImportError:
+        return None
+
+    if not math.isclose(1 - generation.near_limit_coefficient, NEAR_LIMIT_FRACTION):
+        raise RuntimeError(f"NEAR_LIMIT_FRACTION is {NEAR_LIMIT_FRACTION}, but the training data puts the near-limit "
+                           f"band at 1 - near_limit_coefficient = {1 - generation.near_limit_coefficient:g}")
+
+    low, high, regular_high, near_low = generation.parameter_bounds(generation.ranges)
+    expected_count = sum(c * p for c, p in zip(generation.near_limit_param_counts, generation.near_limit_param_count_p))
+    near_share = generation.near_limit_ratio * expected_count / len(generation.ranges)
+
+    parameters = {}
+    # ranges lists the parameters in the order of PARAMETERS
+    for i, parameter in enumerate(PARAMETERS):
+        parts = [(1 - near_share, low[i], regular_high[i]), (near_share, near_low[i], high[i])]
+        mean = sum(w * (a + b) / 2 for w, a, b in parts)
+        second = sum(w * (a * a + a * b + b * b) / 3 for w, a, b in parts)
+        bin_low, bin_high = _bounds(parameter)
+        edges = [bin_low + (bin_high - bin_low) * j / BINS for j in range(BINS + 1)]
+        histogram = [sum(w * _uniform_overlap(a, b, -math.inf, bin_low) for w, a, b in parts)]
+        histogram += [sum(w * _uniform_overlap(a, b, edges[j], edges[j + 1]) for w, a, b in parts) for j in range(BINS)]
+        histogram.append(sum(w * _uniform_overlap(a, b, bin_high, math.inf) for w, a, b in parts))
+        parameters[parameter] = {
+            "mean": mean,
+            "std": math.sqrt(max(second - mean * mean, 0.0)),
+            "near_limit_rate": sum(w * _uniform_overlap(a, b, _near_limit_low(parameter), bin_high) for w, a, b in parts),
+            "exceedance_rate": histogram[0] + histogram[-1],
+            "histogram": histogram,
+        }
+    return {"near_limit_ratio": generation.near_limit_ratio, "parameters": parameters}
+
+
+def psi(observed, expected) -> float:
+    total = 0.0
+    for p, q in zip(observed, expected):
+        p, q = max(p, PSI_FLOOR), max(q, PSI_FLOOR)
+        total += (p - q) * math.log(p / q)
+    return total
+
+
+def _level(value: float) -> str:
+    for bound, name in PSI_LEVELS:
+        if value < bound:
+            return name
+    return "significant"
+
+
+def _moments(row) -> dict:
+    weight = row.ewm_weight
+    mean = row.ewm_sum / weight
+    return {"count": row.value_count, "mean": mean,
+            "std": math.sqrt(max(row.ewm_sum_sq / weight - mean * mean, 0.0))}
+
+
+def summary(db, sample_type: Optional[str] = None, reference: Optional[dict] = None) -> dict:
+    """The statistics of one scope (all samples when sample_type is None), compared with `reference`."""
+    scope = sample_type or ALL_SCOPE
+    rows = {row.parameter: row for row in db.execute(select(drift).where(drift.c.scope == scope))}
+    empty = {"count": 0, "mean": None, "std": None}
+
+    parameters = {}
+    for parameter in PARAMETERS:
+        row = rows.get(parameter)
+        if row is None or not row.ewm_weight:
+            parameters[parameter] = {**empty, "near_limit_rate": None, "exceedance_rate": None, "histogram": None,
+                                     "mean_shift": None, "psi": None, "drift": None, "reference": None}
+            continue
+        stats = _moments(row)
+        stats.update(near_limit_rate=row.ewm_near_limit / row.ewm_weight,
+                     exceedance_rate=row.ewm_exceed / row.ewm_weight,
+                     histogram=[getattr(row, name) / row.ewm_weight for name in BIN_COLUMNS],
+                     mean_shift=None, psi=None, drift=None, reference=None)
+        expected = reference["parameters"][parameter] if reference else None
+        if expected:
+            stats["reference"] = expected
+            stats["mean_shift"] = (stats["mean"] - expected["mean"]) / expected["std"] if expected["std"] else None
+            stats["psi"] = psi(stats["histogram"], expected["histogram"])
+            if row.value_count >= DRIFT_MIN_SAMPLES:
+                stats["drift"] = _level(stats["psi"])
+        parameters[parameter] = stats
+
+    prediction, confidence = rows.get("prediction"), rows.get("confidence")
+    predictions = _moments(prediction) if prediction is not None and prediction.ewm_weight else dict(empty)
+    predictions = {"count": predictions["count"], "near_limit_rate": predictions["mean"],
+                   "reference_near_limit_rate": reference["near_limit_ratio"] if reference else None}
+    if confidence is not None and confidence.ewm_weight:
+        predictions["confidence"] = _moments(confidence)
+    else:
+        predictions["confidence"] = dict(empty)
+
+    return {
+        "scope": scope,
+        "half_life": DRIFT_HALF_LIFE,
+        "bins": {p: {"min": _bounds(p)[0], "max": _bounds(p)[1], "count": BINS} for p in PARAMETERS},
+        "predictions": predictions,
+        "parameters": parameters,
+    }
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    if command != "rebuild":
+        sys.exit(f"Unknown command {command}, expected rebuild")
+    with SessionLocal() as db:
+        rebuild(db)
+        db.commit()
+    print("Drift statistics rebuilt")
@@ -0,0 +1,52 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification off the event loop, in a small pool of its own.
+
+    bcrypt releases the GIL, so threads run it in parallel. The pool is separate from the
+    threadpool that serves the sync endpoints, so a burst of logins cannot starve /predict.
+    At most `max_pending` calls wait or run at once; beyond that PasswordHasherBusy is raised
+    right away instead of queueing without bound.
+    """
+
+    def __init__(self, rounds: int = 12, workers: int = 2, max_pending: int = 32):
+        self.context = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=rounds)
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self.rejected = 0
+
+    async def _run(self, fn, *args):
+        # only touched from the event loop thread, no lock needed
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self.context.verify, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "rejected": self.rejected,
+        }
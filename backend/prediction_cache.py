@@ -0,0 +1,16 @@
+import math
+from typing import Optional
+from cache import LRUCache
+
+
+class PredictionCache(LRUCache):
+    """LRU cache of prediction results keyed on the model version and the rounded inputs."""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, decimals: int = 4):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.decimals = decimals
+
+    def key(self, model_version: str, values) -> tuple:
+        # NaN never compares equal, so missing parameters are keyed as None
+        return (model_version, *(None if value is None or math.isnan(value) else round(value, self.decimals)
+                                 for value in values))
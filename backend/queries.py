@@ -0,0 +1,71 @@
+import base64
+from datetime import date
+from typing import List, Optional, Tuple
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+from database import SampleRecord
+
+
+SAMPLE_COLUMNS = ["id", "Ammonium", "Phosphate", "COD", "BOD", "Conductivity", "PH", "Nitrogen", "Nitrate",
+                  "Turbidity", "TSS", "prediction", "confidence", "sample_type", "timestamp"]
+
+# keyset pagination needs these in every page, whatever was projected
+CURSOR_COLUMNS = ["id", "timestamp"]
+
+
+def encode_cursor(timestamp: date, sample_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{sample_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        timestamp, sample_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return date.fromisoformat(timestamp), int(sample_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in SAMPLE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return [column for column in SAMPLE_COLUMNS if column in requested or column in CURSOR_COLUMNS]
+
+
+def sample_filters(user_id: Optional[int] = None,
+                   sample_type: Optional[str] = None,
+                   after: Optional[Tuple[date, int]] = None,
+                   date_from: Optional[date] = None,
+                   date_to: Optional[date] = None) -> list:
+    filters = []
+    if user_id:
+        filters.append(SampleRecord.user_id == user_id)
+    if sample_type and sample_type != 'all':
+        filters.append(SampleRecord.sample_type == sample_type)
+    if after:
+        filters.append(tuple_(SampleRecord.timestamp, SampleRecord.id) < tuple_(*after))
+    if date_from:
+        filters.append(SampleRecord.timestamp >= date_from)
+    if date_to:
+        filters.append(SampleRecord.timestamp <= date_to)
+    return filters
+
+
+def samples_query(db: Session,
+                  user_id: Optional[int] = None,
+                  sample_type: Optional[str] = None,
+                  after: Optional[Tuple[date, int]] = None,
+                  columns: Optional[List[str]] = None,
+                  date_from: Optional[date] = None,
+                  date_to: Optional[date] = None):
+    if columns:
+        query = db.query(*[getattr(SampleRecord, column) for column in columns])
+    else:
+        query = db.query(SampleRecord)
+
+    query = query.filter(*sample_filters(user_id=user_id, sample_type=sample_type, after=after,
+                                        date_from=date_from, date_to=date_to))
+    return query.order_by(SampleRecord.timestamp.desc(), SampleRecord.id.desc())
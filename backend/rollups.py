@@ -0,0 +1,181 @@
+"""Daily per-user, per-sample_type, per-parameter aggregates of the samples table.
+
+The rollups are updated in the same transaction as the samples they summarize:
+add_samples() after inserts, remove_sample() after a delete. Run this module to
+rebuild them from scratch or to compare them against the raw table:
+
+    python rollups.py backfill
+    python rollups.py check
+"""
+import math
+import sys
+from sqlalchemy import case, delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from database import SampleRecord, SampleDailyRollup
+from stats import PARAMETERS, exceeds_limit, is_exceedance
+
+
+rollups = SampleDailyRollup.__table__
+KEY_COLUMNS = ["day", "user_id", "sample_type", "parameter"]
+VALUE_COLUMNS = ["value_count", "value_sum", "value_sum_sq", "value_min", "value_max", "near_limit_count", "exceed_count"]
+
+
+def _dialect(db):
+    return db.get_bind().dialect.name if hasattr(db, "get_bind") else db.dialect.name
+
+
+def _group_key(day, user_id, sample_type, parameter):
+    return day, user_id or 0, sample_type or "", parameter
+
+
+def add_samples(db, rows):
+    """Fold freshly inserted sample rows (dicts with SampleRecord columns) into the rollups."""
+    deltas = {}
+    for row in rows:
+        near = 1 if row.get("prediction") == 1 else 0
+        for parameter in PARAMETERS:
+            value = row.get(parameter)
+            if value is None:
+                continue
+            key = _group_key(row["timestamp"], row.get("user_id"), row.get("sample_type"), parameter)
+            exceeded = 1 if is_exceedance(value, parameter) else 0
+            delta = deltas.get(key)
+            if delta is None:
+                deltas[key] = [1, value, value * value, value, value, near, exceeded]
+            else:
+                delta[0] += 1
+                delta[1] += value
+                delta[2] += value * value
+                delta[3] = min(delta[3], value)
+                delta[4] = max(delta[4], value)
+                delta[5] += near
+                delta[6] += exceeded
+
+    if not deltas:
+        return
+
+    dialect = _dialect(db)
+    if dialect == "postgresql":
+        stmt, smaller, larger = postgresql.insert(rollups), func.least, func.greatest
+    elif dialect == "sqlite":
+        stmt, smaller, larger = sqlite.insert(rollups), func.min, func.max
+    else:
+        raise ValueError(f"Rollup upserts are not supported on {dialect}")
+
+    stmt = stmt.on_conflict_do_update(index_elements=KEY_COLUMNS, set_={
+        "value_count": rollups.c.value_count + stmt.excluded.value_count,
+        "value_sum": rollups.c.value_sum + stmt.excluded.value_sum,
+        "value_sum_sq": rollups.c.value_sum_sq + stmt.excluded.value_sum_sq,
+        "value_min": smaller(rollups.c.value_min, stmt.excluded.value_min),
+        "value_max": larger(rollups.c.value_max, stmt.excluded.value_max),
+        "near_limit_count": rollups.c.near_limit_count + stmt.excluded.near_limit_count,
+        "exceed_count": rollups.c.exceed_count + stmt.excluded.exceed_count,
+    })
+    # in key order, so concurrent transactions lock the rows they share in the same order instead of deadlocking
+    db.execute(stmt, [dict(zip(KEY_COLUMNS + VALUE_COLUMNS, key + tuple(deltas[key]))) for key in sorted(deltas)])
+
+
+def sample_group_filters(record: SampleRecord) -> list:
+    """Filters for the samples rolled up in the same group as `record`."""
+    day, user_id, sample_type, _ = _group_key(record.timestamp, record.user_id, record.sample_type, None)
+    # grouped as in _raw_aggregates: no user and user 0, no sample type and '' share a rollup group
+    return [SampleRecord.timestamp == day,
+            func.coalesce(SampleRecord.user_id, 0) == user_id,
+            func.coalesce(SampleRecord.sample_type, "") == sample_type]
+
+
+def remove_sample(db, record: SampleRecord):
+    """Take a deleted (and already flushed) sample back out of its rollup group."""
+    near = 1 if record.prediction == 1 else 0
+    day, user_id, sample_type, _ = _group_key(record.timestamp, record.user_id, record.sample_type, None)
+    same_sample_group = sample_group_filters(record)
+    same_rollup_group = [rollups.c.day == day, rollups.c.user_id == user_id, rollups.c.sample_type == sample_type]
+
+    for parameter in PARAMETERS:
+        value = getattr(record, parameter)
+        if value is None:
+            continue
+        column = getattr(SampleRecord, parameter)
+        # min/max cannot be decremented, re-read them from the (indexed) remaining samples of the group
+        remaining = [*same_sample_group, column.isnot(None)]
+        db.execute(
+            update(rollups)
+            .where(*same_rollup_group, rollups.c.parameter == parameter)
+            .values(value_count=rollups.c.value_count - 1,
+                    value_sum=rollups.c.value_sum - value,
+                    value_sum_sq=rollups.c.value_sum_sq - value * value,
+                    value_min=select(func.min(column)).where(*remaining).scalar_subquery(),
+                    value_max=select(func.max(column)).where(*remaining).scalar_subquery(),
+                    near_limit_count=rollups.c.near_limit_count - near,
+                    exceed_count=rollups.c.exceed_count - (1 if is_exceedance(value, parameter) else 0))
+        )
+    db.execute(delete(rollups).where(*same_rollup_group, rollups.c.value_count <= 0))
+
+
+def _raw_aggregates(parameter: str):
+    column = getattr(SampleRecord, parameter)
+    user_id = func.coalesce(SampleRecord.user_id, 0)
+    sample_type = func.coalesce(SampleRecord.sample_type, "")
+    return (
+        select(SampleRecord.timestamp, user_id, sample_type, literal(parameter),
+               func.count(column), func.sum(column), func.sum(column * column), func.min(column), func.max(column),
+               func.sum(case((SampleRecord.prediction == 1, 1), else_=0)),
+               func.sum(case((exceeds_limit(column, parameter), 1), else_=0)))
+        .where(column.isnot(None), SampleRecord.timestamp.isnot(None))
+        .group_by(SampleRecord.timestamp, user_id, sample_type)
+    )
+
+
+def rebuild(db):
+    db.execute(delete(rollups))
+    for parameter in PARAMETERS:
+        db.execute(insert(rollups).from_select(KEY_COLUMNS + VALUE_COLUMNS, _raw_aggregates(parameter)))
+
+
+def _same(expected, actual):
+    if expected is None or actual is None:
+        return expected == actual
+    return math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-6)
+
+
+def check(db):
+    """Return a list of human readable differences between the rollups and the raw samples."""
+    problems = []
+    for parameter in PARAMETERS:
+        expected = {tuple(row[:4]): tuple(row[4:]) for row in db.execute(_raw_aggregates(parameter))}
+        actual = {
+            tuple(row[:4]): tuple(row[4:])
+            for row in db.execute(select(*[rollups.c[c] for c in KEY_COLUMNS + VALUE_COLUMNS])
+                                  .where(rollups.c.parameter == parameter))
+        }
+        for key in expected.keys() - actual.keys():
+            problems.append(f"missing rollup {key}")
+        for key in actual.keys() - expected.keys():
+            problems.append(f"stale rollup {key}")
+        for key in expected.keys() & actual.keys():
+            for name, want, got in zip(VALUE_COLUMNS, expected[key], actual[key]):
+                if not _same(want, got):
+                    problems.append(f"{key} {name}: expected {want}, found {got}")
+    return problems
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    db = SessionLocal()
+    try:
+        if command == "backfill":
+            rebuild(db)
+            db.commit()
+            print("Rollups rebuilt")
+        elif command == "check":
+            problems = check(db)
+            for problem in problems[:100]:
+                print(problem)
+            print(f"{len(problems)} differences" if problems else "Rollups are consistent")
+            sys.exit(1 if problems else 0)
+        else:
+            sys.exit(f"Unknown command {command}, expected backfill or check")
+    finally:
+        db.close()
@@ -0,0 +1,44 @@
+"""Input schema and scoring shared by the API process and the job workers (which do not import main)."""
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from forest_engine import CompiledForest
+
+INPUT_FIELDS = ["Ammonium", "Phosphate", "COD", "BOD", "Conductivity", "PH", "Nitrogen", "Nitrate", "Turbidity", "TSS"]
+FEATURE_COLUMNS = ["Ammonium (mg/l N)", "Ortho Phosphate (mg/l P)", "COD (mg/l O2)" ,"BOD (mg/l O2)", "Conductivity (mS/m)", "pH", "Nitrogen Total (mg/l N)", "Nitrate (mg/l NO3)", "Turbidity (NTU)", "TSS (mg/l)"]
+
+
+class InputData(BaseModel):
+    Ammonium: Optional[float] = None
+    Phosphate: Optional[float] = None
+    COD: Optional[float] = None
+    BOD: Optional[float] = None
+    Conductivity: Optional[float] = None
+    PH: Optional[float] = None
+    Nitrogen: Optional[float] = None
+    Nitrate: Optional[float] = None
+    Turbidity: Optional[float] = None
+    TSS: Optional[float] = None
+
+
+def to_feature_array(samples: List[InputData]) -> np.ndarray:
+    values = np.empty((len(samples), len(INPUT_FIELDS)), dtype=np.float64)
+    for i, sample in enumerate(samples):
+        values[i] = [getattr(sample, field) for field in INPUT_FIELDS]
+    return values
+
+
+def model_input(values: np.ndarray, model):
+    if isinstance(model, CompiledForest):
+        return values
+    return pd.DataFrame(values, columns=FEATURE_COLUMNS, copy=False)
+
+
+def score(features, model):
+    # a single predict_proba pass; the class is the argmax, exactly as RandomForestClassifier.predict does it
+    proba = model.predict_proba(features)
+    best = proba.argmax(axis=1)
+    predictions = model.classes_.take(best)
+    confidences = proba[np.arange(len(best)), best]
+    return predictions, confidences
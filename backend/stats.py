@@ -0,0 +1,207 @@
+from datetime import date
+from typing import List, Optional
+from sqlalchemy import Date, Float, case, cast, func, or_, type_coerce
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from database import SampleRecord, SampleDailyRollup
+
+
+PARAMETERS = ["Ammonium", "Phosphate", "COD", "BOD", "Conductivity", "PH", "Nitrogen", "Nitrate", "Turbidity", "TSS"]
+
+# (min, max) - same values as frontend/src/utils/legalLimits.ts
+LEGAL_LIMITS = {
+    "Ammonium": (None, 1.5),
+    "Phosphate": (None, 0.9),
+    "COD": (None, 125.0),
+    "BOD": (None, 25.0),
+    "Conductivity": (None, 100.0),
+    "PH": (7.0, 9.0),
+    "Nitrogen": (None, 25.0),
+    "Nitrate": (None, 50.0),
+    "Turbidity": (None, 50.0),
+    "TSS": (None, 35.0),
+}
+
+BUCKETS = ("day", "week", "month")
+PERCENTILES = (0.5, 0.9, 0.95)
+
+
+def bucket_expression(dialect: str, bucket: str, column=SampleRecord.timestamp):
+    if dialect == "postgresql":
+        return cast(func.date_trunc(bucket, column), Date)
+    if dialect == "sqlite":
+        if bucket == "week":
+            # Monday of the sample's week, like date_trunc('week')
+            return func.date(column, "weekday 0", "-6 days")
+        if bucket == "month":
+            return func.date(column, "start of month")
+        return column
+    raise ValueError(f"Time buckets are not supported on {dialect}")
+
+
+def is_exceedance(value: float, parameter: str) -> bool:
+    low, high = LEGAL_LIMITS[parameter]
+    return (low is not None and value < low) or (high is not None and value > high)
+
+
+def exceeds_limit(column, parameter: str):
+    low, high = LEGAL_LIMITS[parameter]
+    conditions = []
+    if low is not None:
+        conditions.append(column < low)
+    if high is not None:
+        conditions.append(column > high)
+    return or_(*conditions)
+
+
+def sample_stats_query(db: Session,
+                       bucket: str,
+                       parameters: List[str] = PARAMETERS,
+                       sample_type: Optional[str] = None,
+                       user_id: Optional[int] = None,
+                       date_from: Optional[date] = None,
+                       date_to: Optional[date] = None,
+                       group_by_user: bool = False):
+    """Per bucket and sample_type (and user): count, min, mean, max and exceedances of every parameter,
+    followed by its percentiles on Postgres."""
+    dialect = db.get_bind().dialect.name
+    with_percentiles = dialect == "postgresql"
+
+    keys = [bucket_expression(dialect, bucket), SampleRecord.sample_type]
+    if group_by_user:
+        keys.append(SampleRecord.user_id)
+
+    aggregates = []
+    for parameter in parameters:
+        column = getattr(SampleRecord, parameter)
+        aggregates += [
+            func.count(column),
+            func.min(column),
+            func.avg(column),
+            func.max(column),
+            func.sum(case((exceeds_limit(column, parameter), 1), else_=0)),
+        ]
+        if with_percentiles:
+            percentiles = func.percentile_cont(postgresql.array(PERCENTILES)).within_group(column)
+            aggregates.append(type_coerce(percentiles, postgresql.ARRAY(Float)))
+
+    filters = []
+    if user_id:
+        filters.append(SampleRecord.user_id == user_id)
+    if sample_type and sample_type != 'all':
+        filters.append(SampleRecord.sample_type == sample_type)
+    if date_from:
+        filters.append(SampleRecord.timestamp >= date_from)
+    if date_to:
+        filters.append(SampleRecord.timestamp <= date_to)
+
+    return db.query(*keys, *aggregates).filter(*filters).group_by(*keys).order_by(*keys)
+
+
+def sample_stats(db: Session,
+                 bucket: str,
+                 parameters: List[str] = PARAMETERS,
+                 sample_type: Optional[str] = None,
+                 user_id: Optional[int] = None,
+                 date_from: Optional[date] = None,
+                 date_to: Optional[date] = None,
+                 group_by_user: bool = False) -> List[dict]:
+    query = sample_stats_query(db, bucket, parameters=parameters, sample_type=sample_type, user_id=user_id,
+                               date_from=date_from, date_to=date_to, group_by_user=group_by_user)
+    with_percentiles = db.get_bind().dialect.name == "postgresql"
+    n_keys = 3 if group_by_user else 2
+
+    per_parameter = 6 if with_percentiles else 5
+    series = []
+    for row in query:
+        stats = {}
+        for i, parameter in enumerate(parameters):
+            values = row[n_keys + i * per_parameter:n_keys + (i + 1) * per_parameter]
+            count, minimum, mean, maximum, exceedances = values[:5]
+            stats[parameter] = {
+                "count": count,
+                "min": minimum,
+                "mean": float(mean) if mean is not None else None,
+                "max": maximum,
+                "exceedances": int(exceedances or 0),
+            }
+            if with_percentiles:
+                percentiles = values[5] or [None] * len(PERCENTILES)
+                stats[parameter].update({f"p{round(p * 100)}": value for p, value in zip(PERCENTILES, percentiles)})
+
+        series.append({
+            "bucket": str(row[0]),
+            "sample_type": row[1],
+            "user_id": row[2] if group_by_user else None,
+            "stats": stats,
+        })
+    return series
+
+
+def rollup_stats_query(db: Session,
+                       bucket: str,
+                       parameters: List[str] = PARAMETERS,
+                       sample_type: Optional[str] = None,
+                       user_id: Optional[int] = None,
+                       date_from: Optional[date] = None,
+                       date_to: Optional[date] = None,
+                       group_by_user: bool = False):
+    """Per bucket, sample_type (and user) and parameter: the count, min, sum, max and exceedances in the rollups."""
+    rollup = SampleDailyRollup
+    dialect = db.get_bind().dialect.name
+
+    keys = [bucket_expression(dialect, bucket, rollup.day), rollup.sample_type]
+    if group_by_user:
+        keys.append(rollup.user_id)
+
+    filters = [rollup.parameter.in_(parameters)]
+    if user_id:
+        filters.append(rollup.user_id == user_id)
+    if sample_type and sample_type != 'all':
+        filters.append(rollup.sample_type == sample_type)
+    if date_from:
+        filters.append(rollup.day >= date_from)
+    if date_to:
+        filters.append(rollup.day <= date_to)
+
+    return (db.query(*keys, rollup.parameter,
+                     func.sum(rollup.value_count), func.min(rollup.value_min), func.sum(rollup.value_sum),
+                     func.max(rollup.value_max), func.sum(rollup.exceed_count))
+            .filter(*filters)
+            .group_by(*keys, rollup.parameter)
+            .order_by(*keys))
+
+
+def rollup_stats(db: Session,
+                 bucket: str,
+                 parameters: List[str] = PARAMETERS,
+                 sample_type: Optional[str] = None,
+                 user_id: Optional[int] = None,
+                 date_from: Optional[date] = None,
+                 date_to: Optional[date] = None,
+                 group_by_user: bool = False) -> List[dict]:
+    """Same series as sample_stats, minus percentiles, read from the daily rollups instead of the raw samples."""
+    query = rollup_stats_query(db, bucket, parameters=parameters, sample_type=sample_type, user_id=user_id,
+                               date_from=date_from, date_to=date_to, group_by_user=group_by_user)
+    n_keys = 3 if group_by_user else 2
+
+    empty = {"count": 0, "min": None, "mean": None, "max": None, "exceedances": 0}
+    series = {}
+    for row in query:
+        group = tuple(row[:n_keys])
+        parameter, count, minimum, total, maximum, exceedances = row[n_keys:]
+        if group not in series:
+            series[group] = {
+                "bucket": str(group[0]),
+                "sample_type": group[1] or None,
+                "user_id": (group[2] or None) if group_by_user else None,
+                "stats": {p: dict(empty) for p in parameters},
+            }
+        series[group]["stats"][parameter] = {
+            "count": count,
+            "min": minimum,
+            "mean": total / count if count else None,
+            "max": maximum,
+            "exceedances": int(exceedances or 0),
+        }
+    return list(series.values())
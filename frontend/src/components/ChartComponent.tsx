@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Line } from 'react-chartjs-2';
 import legalLimits, { parameterUnits } from '../utils/legalLimits';
 import type { ParameterName } from '../utils/legalLimits';
@@ -16,25 +16,36 @@ import {
 
 ChartJS.register(CategoryScale, LinearScale, PointElement, LineElement, Title, Filler, Tooltip, Legend);
 
-interface Sample {
-  timestamp: string;
-  Ammonium: number;
-  Phosphate: number;
-  COD: number;
-  BOD: number;
-  Conductivity: number;
-  PH: number;
-  Nitrogen: number;
-  Nitrate: number;
-  Turbidity: number;
-  TSS: number;
-  [key: string]: any; 
+type Bucket = 'day' | 'week' | 'month';
+
+interface ParameterStats {
+  count: number;
+  min: number | null;
+  mean: number | null;
+  max: number | null;
+  exceedances: number;
+}
+
+interface StatsPoint {
+  bucket: string;
+  sample_type: string;
+  stats: Record<string, ParameterStats>;
 }
 
 interface Props {
-  data: Sample[];
+  sampleType: string;
+  userId: number | null;
+  refreshKey?: number;
 }
 
+const seriesColors = [
+  'rgb(75, 192, 192)',
+  'rgb(30, 58, 138)',
+  'rgb(234, 88, 12)',
+  'rgb(107, 114, 128)',
+  'rgb(147, 51, 234)',
+];
+
 const options = {
   responsive: true,
   maintainAspectRatio: false,
@@ -70,37 +81,59 @@ const options = {
 };
 
 
-const ChartComponent: React.FC<Props> = ({ data }) => {
+const ChartComponent: React.FC<Props> = ({ sampleType, userId, refreshKey }) => {
   const [selectedParam, setSelectedParam] = useState<ParameterName>('Ammonium');
+  const [bucket, setBucket] = useState<Bucket>('day');
+  const [points, setPoints] = useState<StatsPoint[]>([]);
 
   const limit = legalLimits[selectedParam];
   const [showLimits, setShowLimits] = useState(true);
 
-const filteredSortedData = [...data]
-  .filter(d => typeof d[selectedParam] === 'number')
-  .sort((a, b) => new Date(a.timestamp).getTime() - new Date(b.timestamp).getTime());
+  useEffect(() => {
+    let url = `${import.meta.env.VITE_API_URL}/samples/stats?bucket=${bucket}&parameters=${selectedParam}&sample_type=${sampleType}&percentiles=false`;
+    if (userId) {
+      url += `&user_id=${userId}`;
+    }
+
+    fetch(url)
+      .then(res => res.json())
+      .then(data => setPoints(data.series))
+      .catch(err => console.error('Fetch stats error:', err));
+  }, [selectedParam, bucket, sampleType, userId, refreshKey]);
+
+  const buckets = [...new Set(points.filter(p => p.stats[selectedParam]?.count).map(p => p.bucket))].sort();
+  const sampleTypes = [...new Set(points.map(p => p.sample_type))];
 
   const chartData = {
-    labels: filteredSortedData.map(d =>
-      new Date(d.timestamp).toLocaleString(undefined, {
+    labels: buckets.map(b =>
+      new Date(b).toLocaleString(undefined, {
         year: 'numeric',
         month: '2-digit',
-        day: '2-digit',
+        day: bucket === 'month' ? undefined : '2-digit',
       })
     ),
     datasets: [
-      {
-        label: selectedParam,
-        data: filteredSortedData.map(d => d[selectedParam]),
-        borderColor: 'rgb(75, 192, 192)',
-        backgroundColor: 'rgba(75, 192, 192, 0.2)',
-        fill: true,
-        tension: 0.3,
-      },
+      ...sampleTypes.map((type, i) => {
+        const means = new Map(
+          points
+            .filter(p => p.sample_type === type)
+            .map(p => [p.bucket, p.stats[selectedParam]?.mean ?? null] as [string, number | null])
+        );
+        const color = seriesColors[i % seriesColors.length];
+        return {
+          label: sampleTypes.length > 1 ? `${selectedParam} (${type})` : selectedParam,
+          data: buckets.map(b => means.get(b) ?? null),
+          borderColor: color,
+          backgroundColor: color.replace('rgb', 'rgba').replace(')', ', 0.2)'),
+          fill: sampleTypes.length === 1,
+          spanGaps: true,
+          tension: 0.3,
+        };
+      }),
       ...(showLimits && limit?.max !== undefined
         ? [{
             label: 'Legal max',
-            data: new Array(filteredSortedData.length).fill(limit.max),
+            data: new Array(buckets.length).fill(limit.max),
             borderColor: 'green',
             borderDash: [10, 5],
             borderWidth: 2,
@@ -112,7 +145,7 @@ const filteredSortedData = [...data]
       ...(showLimits && limit?.min !== undefined
         ? [{
             label: 'Legal min',
-            data: new Array(filteredSortedData.length).fill(limit.min),
+            data: new Array(buckets.length).fill(limit.min),
             borderColor: 'red',
             borderDash: [10, 5],
             borderWidth: 2,
@@ -151,6 +184,15 @@ const filteredSortedData = [...data]
             <option value="Turbidity">Turbidity</option>
             <option value="TSS">TSS</option>
           </select>
+          <select
+            value={bucket}
+            onChange={e => setBucket(e.target.value as Bucket)}
+            className="w-full max-w-[140px] px-3 py-2 mb-0 md:mb-2 cursor-pointer border border-gray-300 rounded shadow-sm text-sm focus:outline-none focus:ring-2 focus:ring-blue-300"
+          >
+            <option value="day">Daily mean</option>
+            <option value="week">Weekly mean</option>
+            <option value="month">Monthly mean</option>
+          </select>
           <div className="mt-4 flex ml-3 items-center sm:pb-6 space-x-2">
             <input
               id="showLimits"
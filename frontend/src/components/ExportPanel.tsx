@@ -1,12 +1,14 @@
 import React, { useState } from "react";
 
+export type ExportFileType = "csv" | "excel" | "parquet";
+
 interface ExportPanelProps {
-  onExport: (fileName: string, fileType: "csv" | "excel") => void;
+  onExport: (fileName: string, fileType: ExportFileType) => void;
 }
 
 const ExportPanel: React.FC<ExportPanelProps> = ({ onExport }) => {
   const [fileName, setFileName] = useState("");
-  const [fileType, setFileType] = useState<"csv" | "excel">("excel");
+  const [fileType, setFileType] = useState<ExportFileType>("excel");
 
   const handleExport = () => {
     if (!fileName) {
@@ -27,11 +29,12 @@ const ExportPanel: React.FC<ExportPanelProps> = ({ onExport }) => {
       />
       <select
         value={fileType}
-        onChange={(e) => setFileType(e.target.value as "csv" | "excel")}
+        onChange={(e) => setFileType(e.target.value as ExportFileType)}
         className="px-3 py-2 border rounded w-full cursor-pointer sm:w-40 text-sm bg-white shadow-sm focus:outline-none focus:ring-2 focus:ring-blue-300"
       >
         <option value="excel">Excel (.xlsx)</option>
         <option value="csv">CSV (.csv)</option>
+        <option value="parquet">Parquet (.parquet)</option>
       </select>
       <button 
         onClick={handleExport} 
@@ -2,10 +2,10 @@ import React, { useEffect, useState } from "react";
 import ChartComponent from "../components/ChartComponent";
 import SamplesFilter from "../components/SamplesFilter";
 import ExportPanel from "../components/ExportPanel";
+import type { ExportFileType } from "../components/ExportPanel";
 import AddSampleComponent from "../components/AddSampleComponent";
 import legalLimits, { parameterUnits } from "../utils/legalLimits";
 import type { ParameterName } from "../utils/legalLimits";
-import { exportToExcel, exportToCSV } from "../utils/exportUtils";
 import { isAuthenticated, getLoggedUserId, getToken } from "../utils/auth";
 
 interface Sample {
@@ -44,6 +44,7 @@ interface User {
 }
 
 const THRESHOLD = 0.8; // 80%
+const PAGE_SIZE = 50;
 
 const getValueClass = (param: ParameterName, value: number): string => {
   const limit = legalLimits[param];
@@ -68,11 +69,15 @@ const History: React.FC = () => {
   const [showForm, setShowForm] = useState(false);
   const [selectedUser, setSelectedUser] = useState<number | "">("");
   const [users, setUsers] = useState<User[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [statsVersion, setStatsVersion] = useState(0);
 
-  const fetchSamples = () => {
+  const filterUserId = isAuthenticated() ? getLoggedUserId() : (selectedUser || null);
+
+  const fetchSamples = (cursor: string | null = null) => {
     const loggedUserId = isAuthenticated() ? getLoggedUserId() : null;
 
-    let url = `${import.meta.env.VITE_API_URL}/samples?sample_type=${selectedType}`;
+    let url = `${import.meta.env.VITE_API_URL}/samples?sample_type=${selectedType}&limit=${PAGE_SIZE}`;
     if (isAuthenticated()) {
       if (loggedUserId) {
         url += `&user_id=${loggedUserId}`;
@@ -83,9 +88,16 @@ const History: React.FC = () => {
       }
     }
 
+    if (cursor) {
+      url += `&cursor=${encodeURIComponent(cursor)}`;
+    }
+
     fetch(url)
-      .then(res => res.json())
-      .then(data => setSamples(data))
+      .then(res => {
+        setNextCursor(res.headers.get('X-Next-Cursor'));
+        return res.json();
+      })
+      .then(data => setSamples(prev => cursor ? [...prev, ...data] : data))
       .catch(err => console.error('Fetch error:', err));
 };
 
@@ -101,44 +113,28 @@ const History: React.FC = () => {
     .catch(err => console.error('Fetch users error:', err));
   }, []);
 
-  const handleExport = (fileName: string, fileType: "csv" | "excel") => {
+  const handleExport = (fileName: string, fileType: ExportFileType) => {
     if (!samples || samples.length === 0) {
         alert("No data to export.");
         return;
       }
-    
-    const isPrediction = selectedType === 'prediction' || selectedType === 'all';
-
-    const filteredSamples = samples.map(({ id, timestamp, prediction, confidence, ...rest }) => {
-      const base: any = {
-        ID: id,
-        Timestamp: new Date(timestamp).toLocaleString(),
-      };
-
-      Object.entries(rest).forEach(([key, value]) => {
-        const displayName =
-          key === "PH" ? "pH" :          
-          key === "Nitrogen" ? "Nitrogen Total" :
-          key === "sample_type" ? "Sample Type" :
-          key;
-
-        const unit = parameterUnits[key as ParameterName] || "";
-        base[unit ? `${displayName} (${unit})` : displayName] = value;
-      });
-
-    if (isPrediction && prediction !== -1 && confidence !== -1) {
-      base.Prediction = prediction === 1 ? "warning" : "normal";
-      base.Confidence = `${confidence}%`;
-    }
 
-      return base;
+    // the backend streams every matching sample, not only the pages loaded so far
+    const params = new URLSearchParams({
+      format: fileType === "excel" ? "xlsx" : fileType,
+      sample_type: selectedType,
+      filename: fileName,
     });
-
-    if (fileType === "csv") {
-      exportToCSV(filteredSamples, fileName);
-    } else {
-      exportToExcel(filteredSamples, fileName);
+    if (filterUserId) {
+      params.set("user_id", String(filterUserId));
     }
+
+    const link = document.createElement("a");
+    link.href = `${import.meta.env.VITE_API_URL}/samples/export?${params}`;
+    link.download = "";
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
   };
 
   const formatDate = (dateString: string) => {
@@ -171,6 +167,7 @@ const History: React.FC = () => {
         }
 
         setSamples(prev => prev.filter(sample => sample.id !== id));
+        setStatsVersion(v => v + 1);
         setExpandedId(null);
     } catch (err) {
         console.error('Delete error:', err);
@@ -343,7 +340,7 @@ const History: React.FC = () => {
             )}
           </div>
         </div>
-        <ChartComponent data={samples} />
+        <ChartComponent sampleType={selectedType} userId={filterUserId} refreshKey={statsVersion} />
         <div className="flex flex-wrap gap-4 mb-4 justify-center">
           <ExportPanel onExport={handleExport} />
           {isAuthenticated() && (
@@ -361,6 +358,7 @@ const History: React.FC = () => {
           onSampleAdded={() => {
             setShowForm(false);
             fetchSamples();
+            setStatsVersion(v => v + 1);
           }}
         />
         )}
@@ -380,6 +378,14 @@ const History: React.FC = () => {
             />
         )
         )}
+        {nextCursor && (
+          <button
+            onClick={() => fetchSamples(nextCursor)}
+            className="px-4 py-2 bg-[#1e3a8a] w-full sm:max-w-[410px] mx-auto cursor-pointer text-white rounded hover:bg-blue-700 transition-all text-sm"
+          >
+            Load more
+          </button>
+        )}
     </div>
   );
 
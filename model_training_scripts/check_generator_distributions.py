@@ -0,0 +1,156 @@
+"""Check that the vectorized generators draw from the same distributions as the original loops.
+
+    python check_generator_distributions.py --rows 20000
+
+The original per-sample implementations are kept below as the reference. Every column is
+compared with a two-sample Kolmogorov-Smirnov test, the label rates and (for the realistic
+generator) the number of near limit parameters per row with a chi-square test.
+Exits with status 1 when any test rejects at --alpha, Bonferroni-corrected over all tests.
+"""
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from scipy import stats
+from datasetGeneration import (correlation_matrix, generate_dataset, generate_realistic_dataset, near_limit_coefficient,
+                               near_limit_ratio, ranges)
+
+
+def reference_dataset(ranges, n_samples):
+    data = {param: [] for param in ranges}
+    target = []
+    params = list(ranges.keys())
+
+    for _ in range(n_samples):
+        is_near = np.random.rand() < near_limit_ratio
+
+        for param, (low, high) in ranges.items():
+            if is_near:
+                near_limit_param_count = np.random.choice([1, 2, 3], p=[0.6, 0.3, 0.1])
+
+                near_limit_params = set(np.random.choice(params, size=near_limit_param_count, replace=False))
+                if low:
+                    difference = high - low
+                    if param in near_limit_params:
+                        value = np.random.uniform(high - difference * (1 - near_limit_coefficient), high)
+                    else:
+                        value = np.random.uniform(low, high - difference * near_limit_coefficient)
+                else:
+                    if param in near_limit_params:
+                        value = np.random.uniform(high * near_limit_coefficient, high)
+                    else:
+                        value = np.random.uniform(low, high * near_limit_coefficient)
+            else:
+                if low:
+                    difference = high - low
+                    value = np.random.uniform(low, high - difference * near_limit_coefficient)
+                else:
+                    value = np.random.uniform(low, high * near_limit_coefficient)
+
+            data[param].append(value)
+        target.append(int(is_near))
+
+    data['Near_Limit'] = target
+    return data
+
+
+def sample_within_range(mean, std, low, high):
+    while True:
+        value = np.random.normal(mean, std)
+        if low <= value <= high:
+            return value
+
+
+def reference_realistic_dataset(ranges, n_samples, means, stds):
+    data = {param: [] for param in ranges}
+    near_limit_param_list = []
+    target = []
+    params = list(ranges.keys())
+
+    covariance_matrix = correlation_matrix * np.outer(stds, stds)
+    synthetic_samples = np.abs(np.random.multivariate_normal(means, covariance_matrix, size=n_samples))
+
+    for row in synthetic_samples:
+        is_near = np.random.rand() < near_limit_ratio
+
+        if is_near:
+            near_limit_param_count = np.random.choice([1, 2, 3], p=[0.6, 0.3, 0.1])
+            near_limit_params = set(np.random.choice(params, size=near_limit_param_count, replace=False))
+            near_limit_param_list.append(','.join(sorted(near_limit_params)))
+
+            for i, param in enumerate(params):
+                low, high = ranges[param]
+                if param in near_limit_params:
+                    value = sample_within_range(means[i] + stds[i], stds[i] * 0.5, low, high)
+                else:
+                    value = row[i]
+                data[param].append(value)
+        else:
+            near_limit_param_list.append('')
+            for i, param in enumerate(params):
+                data[param].append(row[i])
+
+        target.append(int(is_near))
+
+    data['Near_Limit'] = target
+    data['Near_Limit_Params'] = near_limit_param_list
+    return data
+
+
+def compare(name, expected, actual):
+    """p-value of every test, keyed by a readable test name."""
+    p_values = {}
+    for column in ranges:
+        p_values[f"{name} {column}"] = stats.ks_2samp(expected[column], actual[column]).pvalue
+
+    # split by label as well, so the near limit shift itself is compared
+    for label in (0, 1):
+        for column in ranges:
+            p_values[f"{name} {column} Near_Limit={label}"] = stats.ks_2samp(
+                expected.loc[expected['Near_Limit'] == label, column],
+                actual.loc[actual['Near_Limit'] == label, column]).pvalue
+
+    counts = [[(frame['Near_Limit'] == label).sum() for label in (0, 1)] for frame in (expected, actual)]
+    p_values[f"{name} Near_Limit rate"] = stats.chi2_contingency(counts).pvalue
+
+    if 'Near_Limit_Params' in expected:
+        table = pd.DataFrame({
+            "expected": expected['Near_Limit_Params'].str.count(',').where(expected['Near_Limit_Params'] != '', -1).value_counts(),
+            "actual": actual['Near_Limit_Params'].str.count(',').where(actual['Near_Limit_Params'] != '', -1).value_counts(),
+        }).fillna(0)
+        p_values[f"{name} near limit params per row"] = stats.chi2_contingency(table.T.values).pvalue
+    return p_values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--alpha", type=float, default=0.01)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+
+    p_values = compare("uniform", pd.DataFrame(reference_dataset(ranges, args.rows)),
+                       pd.DataFrame(generate_dataset(ranges, args.rows, rng=rng)))
+
+    # real_measurements.xlsx is not needed for the comparison, any plausible statistics do
+    low = np.array([low for low, _ in ranges.values()])
+    high = np.array([high for _, high in ranges.values()])
+    means, stds = low + (high - low) * 0.4, (high - low) * 0.2
+    p_values.update(compare("realistic", pd.DataFrame(reference_realistic_dataset(ranges, args.rows, means, stds)),
+                            pd.DataFrame(generate_realistic_dataset(ranges, args.rows, rng=rng, means=means, stds=stds))))
+
+    threshold = args.alpha / len(p_values)
+    failures = []
+    for test, p_value in p_values.items():
+        print(f"{test:<50} p={p_value:.4f}{'  DIFFERENT' if p_value < threshold else ''}")
+        if p_value < threshold:
+            failures.append(test)
+    print(f"{len(failures)} distributions differ: {', '.join(failures)}" if failures else "distributions match")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from realDataAnalysis import calculate_means
+from scipy.special import ndtr, ndtri
+from realDataAnalysis import calculate_means, load_measurements
 
 # number of samples
 n_samples = 10_000
@@ -12,6 +15,10 @@ near_limit_ratio = 0.2  # 20% near limit
 # near limit coefficient
 near_limit_coefficient = 0.8
 
+# how many parameters of a near limit sample are pushed towards the limit
+near_limit_param_counts = [1, 2, 3]
+near_limit_param_count_p = [0.6, 0.3, 0.1]
+
 exceed_ratio = 0.05
 below_detection_ratio = 0.02
 
@@ -46,111 +53,198 @@ ranges = {
 }
 
 
-def generate_dataset(ranges, n_samples):
-    print("dataset generation...")
-    data = {param: [] for param in ranges}
-    target = []
-    params = list(ranges.keys())
+def parameter_bounds(ranges):
+    """Per-parameter (low, high, regular upper bound, near limit lower bound) as arrays."""
+    low = np.array([low for low, _ in ranges.values()], dtype=np.float64)
+    high = np.array([high for _, high in ranges.values()], dtype=np.float64)
+    difference = high - low
+    # ranges starting at 0 scale the upper limit, the others scale the width of the range
+    regular_high = np.where(low != 0, high - difference * near_limit_coefficient, high * near_limit_coefficient)
+    near_low = np.where(low != 0, high - difference * (1 - near_limit_coefficient), high * near_limit_coefficient)
+    return low, high, regular_high, near_low
 
-    for _ in range(n_samples):
-        is_near = np.random.rand() < near_limit_ratio  # 20% near limit
-
-        for param, (low, high) in ranges.items():
-            if is_near:
-                near_limit_param_count = np.random.choice([1, 2, 3], p=[0.6, 0.3, 0.1])
-
-                near_limit_params = set(np.random.choice(params, size=near_limit_param_count, replace=False))
-                if low:
-                    difference = high - low
-                    if param in near_limit_params:
-                        value = np.random.uniform(high - difference * (1 - near_limit_coefficient), high)
-                    else:
-                        value = np.random.uniform(low, high - difference * near_limit_coefficient)
-                else:
-                    if param in near_limit_params:
-                        value = np.random.uniform(high * near_limit_coefficient, high)
-                    else:
-                        value = np.random.uniform(low, high * near_limit_coefficient)
-            else:
-                if low:
-                    difference = high - low
-                    value = np.random.uniform(low, high - difference * near_limit_coefficient)
-                else:
-                    value = np.random.uniform(low, high * near_limit_coefficient)
-
-            data[param].append(value)
-        target.append(int(is_near))  # 1 if near, 0 otherwise
-
-    data['Near_Limit'] = target
-    return data
 
+def generate_dataset(ranges, n_samples, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    low, high, regular_high, near_low = parameter_bounds(ranges)
 
-def sample_within_range(mean, std, low, high):
-    while True:
-        value = np.random.normal(mean, std)
-        if low <= value <= high:
-            return value
+    is_near = rng.random(n_samples) < near_limit_ratio  # 20% near limit
+    # every parameter of a near sample is picked on its own draw of 1-3 parameters,
+    # so each one ends up near its limit with probability E[count] / number of parameters
+    near_param_p = np.dot(near_limit_param_counts, near_limit_param_count_p) / len(ranges)
+    near_params = is_near[:, np.newaxis] & (rng.random((n_samples, len(ranges))) < near_param_p)
 
+    lower = np.where(near_params, near_low, low)
+    upper = np.where(near_params, high, regular_high)
+    values = rng.uniform(lower, upper)
 
-def generate_realistic_dataset(ranges, n_samples):
-    print("dataset generation...")
-    data = {param: [] for param in ranges}
-    near_limit_param_list = []
-    target = []
-    params = list(ranges.keys())
+    data = {param: values[:, i] for i, param in enumerate(ranges)}
+    data['Near_Limit'] = is_near.astype(np.int64)  # 1 if near, 0 otherwise
+    return data
+
+
+def truncated_normal(rng, mean, std, low, high):
+    """Normal(mean, std) draws restricted to [low, high], by inverting the CDF instead of rejecting."""
+    a = (low - mean) / std
+    b = (high - mean) / std
+    # draw intervals above the mean as their mirror image, where ndtr keeps its precision
+    flip = a > 0
+    a, b = np.where(flip, -b, a), np.where(flip, -a, b)
+    z = ndtri(rng.uniform(ndtr(a), ndtr(b)))
+    z = np.where(flip, -z, z)
+    return np.clip(mean + std * z, low, high)
 
-    mean_dict, std_dict = calculate_means(pd.read_excel('real_measurements.xlsx', sheet_name='20025'))
 
-    means = np.array([mean_dict[param] for param in params])
-    stds = np.array([std_dict[param] for param in params])
+def load_real_statistics(params):
+    mean_dict, std_dict = calculate_means(load_measurements('real_measurements.xlsx', sheet_name='20025'))
 
     print('mean values:')
     for key, value in mean_dict.items():
         print(key, value)
 
+    return np.array([mean_dict[param] for param in params]), np.array([std_dict[param] for param in params])
+
+
+def near_limit_selection(rng, n_samples, n_params):
+    """Row-wise mask of 1-3 distinct parameters for near limit rows, nothing for the others."""
+    is_near = rng.random(n_samples) < near_limit_ratio
+    counts = rng.choice(near_limit_param_counts, size=n_samples, p=near_limit_param_count_p)
+    # a random permutation per row, the first `count` positions are the selected parameters
+    ranks = rng.random((n_samples, n_params)).argsort(axis=1).argsort(axis=1)
+    return is_near, is_near[:, np.newaxis] & (ranks < counts[:, np.newaxis])
+
+
+def near_limit_labels(params, mask):
+    """Comma-separated sorted names of the selected parameters of every row."""
+    codes = mask.astype(np.int64) @ (1 << np.arange(len(params), dtype=np.int64))
+    unique, inverse = np.unique(codes, return_inverse=True)
+    labels = np.array([','.join(sorted(param for i, param in enumerate(params) if code >> i & 1)) for code in unique],
+                      dtype=object)
+    return labels[inverse]
+
+
+def generate_realistic_dataset(ranges, n_samples, rng=None, means=None, stds=None, raw_excel_path=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    params = list(ranges.keys())
+    low, high, _, _ = parameter_bounds(ranges)
+
+    if means is None or stds is None:
+        means, stds = load_real_statistics(params)
+
     covariance_matrix = correlation_matrix * np.outer(stds, stds)
 
-    synthetic_samples = np.random.multivariate_normal(means, covariance_matrix, size=n_samples)
+    synthetic_samples = rng.multivariate_normal(means, covariance_matrix, size=n_samples)
+
+    if raw_excel_path:
+        pd.DataFrame(synthetic_samples, columns=params).to_excel(raw_excel_path, index=False)
 
-    raw_df = pd.DataFrame(synthetic_samples, columns=params)
+    synthetic_samples = np.abs(synthetic_samples)
 
-    raw_df.to_excel("synthetic_raw_before_clipping.xlsx", index=False)
+    is_near, near_params = near_limit_selection(rng, n_samples, len(params))
+    rows, columns = np.nonzero(near_params)
+    # selected parameters are redrawn around one std above their mean, within the legal range
+    synthetic_samples[rows, columns] = truncated_normal(rng, means[columns] + stds[columns], stds[columns] * 0.5,
+                                                        low[columns], high[columns])
 
-    for i, param in enumerate(params):
-        low, high = ranges[param]
-        synthetic_samples[:, i] = abs(synthetic_samples[:, i])
+    data = {param: synthetic_samples[:, i] for i, param in enumerate(params)}
+    data['Near_Limit'] = is_near.astype(np.int64)  # 1 if near, 0 otherwise
+    data['Near_Limit_Params'] = near_limit_labels(params, near_params)
+    return data
 
-    for row in synthetic_samples:
-        is_near = np.random.rand() < near_limit_ratio
 
-        if is_near:
-            near_limit_param_count = np.random.choice([1, 2, 3], p=[0.6, 0.3, 0.1])
-            near_limit_params = set(np.random.choice(params, size=near_limit_param_count, replace=False))
-            near_limit_param_list.append(','.join(sorted(near_limit_params)))
+def iter_dataset_chunks(n_samples, chunk_size=1_000_000, seed=None, realistic=False):
+    """DataFrames of at most chunk_size rows, drawn from one Generator so a seed fixes the whole dataset."""
+    rng = np.random.default_rng(seed)
+    if realistic:
+        means, stds = load_real_statistics(list(ranges))
+
+    for start in range(0, n_samples, chunk_size):
+        size = min(chunk_size, n_samples - start)
+        if realistic:
+            data = generate_realistic_dataset(ranges, size, rng=rng, means=means, stds=stds)
+        else:
+            data = generate_dataset(ranges, size, rng=rng)
+        yield pd.DataFrame(data)
 
-            new_row = []
-            for i, param in enumerate(params):
-                low, high = ranges[param]
-                difference = high - low
-                if param in near_limit_params:
-                    # value = np.random.uniform(high - difference * (1 - near_limit_coefficient), high)  # ?
-                    value = sample_within_range(means[i] + stds[i], stds[i] * 0.5, low, high)  # do usprawnienia bo moze byc juz ponad srednia duzo
-                else:
-                    # value = sample_within_range(means[i], stds[i], low, high)
-                    value = row[i]
-                # value = np.clip(value, low, high)  # ?
 
-                new_row.append(value)
-                data[param].append(value)
+class DatasetWriter:
+    """Appends DataFrame chunks to a .parquet or .csv file, so only one chunk is in memory at a time."""
 
+    def __init__(self, path):
+        if not path.endswith((".parquet", ".csv")):
+            raise ValueError(f"Unsupported output {path}, expected .parquet or .csv")
+        self.path = path
+        self.rows = 0
+        self._parquet_writer = None
+
+    def write(self, chunk):
+        if self.path.endswith(".parquet"):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
         else:
-            near_limit_param_list.append('')
-            for i, param in enumerate(params):
-                value = row[i]
-                data[param].append(value)
+            chunk.to_csv(self.path, mode="w" if self.rows == 0 else "a", header=self.rows == 0, index=False)
+        self.rows += len(chunk)
 
-        target.append(int(is_near))  # 1 if near, 0 otherwise
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
 
-    data['Near_Limit'] = target
-    data['Near_Limit_Params'] = near_limit_param_list
-    return data
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_dataset(path, n_samples, chunk_size=1_000_000, seed=None, realistic=False):
+    """Generate straight into a .parquet or .csv file, one chunk in memory at a time."""
+    with DatasetWriter(path) as writer:
+        print("dataset generation...")
+        for chunk in iter_dataset_chunks(n_samples, chunk_size, seed, realistic):
+            writer.write(chunk)
+
+
+def _write_shard(task):
+    path, size, seed_sequence, realistic, means, stds = task
+    rng = np.random.default_rng(seed_sequence)
+    if realistic:
+        data = generate_realistic_dataset(ranges, size, rng=rng, means=means, stds=stds)
+    else:
+        data = generate_dataset(ranges, size, rng=rng)
+    pd.DataFrame(data).to_parquet(path, index=False)
+    return path
+
+
+def write_sharded_dataset(directory, n_samples, seed=None, workers=None, shard_size=1_000_000, realistic=False):
+    """Generate into directory/part-NNNNN.parquet, one shard per task, on up to `workers` processes.
+
+    Every shard gets its own stream spawned from the seed, by shard index, and shards always have
+    shard_size rows (the last one the rest), so a seed gives the same files for any number of workers.
+    """
+    print("dataset generation...")
+    os.makedirs(directory, exist_ok=True)
+    # parts of an earlier, larger run would otherwise be read as part of this dataset
+    for name in os.listdir(directory):
+        if name.startswith("part-") and name.endswith(".parquet"):
+            os.remove(os.path.join(directory, name))
+
+    root = np.random.SeedSequence(seed)
+    if seed is None:
+        print(f"seed: {root.entropy}")
+
+    means, stds = load_real_statistics(list(ranges)) if realistic else (None, None)
+    n_shards = -(-n_samples // shard_size)
+    tasks = [(os.path.join(directory, f"part-{i:05d}.parquet"), min(shard_size, n_samples - i * shard_size),
+              child, realistic, means, stds)
+             for i, child in enumerate(root.spawn(n_shards))]
+
+    if workers == 1:
+        return [_write_shard(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_write_shard, tasks))
@@ -1,41 +1,80 @@
-import pandas as pd
-from datasetGeneration import generate_dataset, n_samples, ranges, near_limit_coefficient
+import argparse
+from datasetGeneration import DatasetWriter, iter_dataset_chunks, n_samples, parameter_bounds, ranges, \
+    write_sharded_dataset
 from train_model import train_model, predict_from_sample
+from model_search import search_hyperparameters
 
 
-def highlight_and_export_to_excel(dataFrame):
-    print("exporting to excel...")
-    with pd.ExcelWriter("highlighted_data.xlsx", engine='xlsxwriter') as writer:
-        dataFrame.to_excel(writer, index=False, sheet_name='Data')
-        workbook = writer.book
-        worksheet = writer.sheets['Data']
+EXPORT_FORMATS = ("csv", "xlsx", "parquet")
+EXCEL_MAX_ROWS = 1_048_576
 
-        yellow_format = workbook.add_format({'bg_color': '#FFFF00'})
 
-        for col_idx, (param, (low, high)) in enumerate(ranges.items()):
-            col_letter = chr(65 + col_idx)  # np. 65 → 'A'
-            cell_range = f"{col_letter}2:{col_letter}{len(dataFrame) + 1}"
+def open_highlighted_workbook(path, columns):
+    import xlsxwriter
 
-            if low:
-                difference = high - low
-                near_limit_threshold = high - difference * (1 - near_limit_coefficient)
-            else:
-                near_limit_threshold = high * near_limit_coefficient
+    # constant_memory flushes every row once the next one starts, rows must be written in order
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Data')
+    worksheet.write_row(0, 0, list(columns))
+    return workbook, worksheet
 
-            worksheet.conditional_format(cell_range, {
+
+def highlight_near_limit_values(workbook, worksheet, columns, n_rows):
+    yellow_format = workbook.add_format({'bg_color': '#FFFF00'})
+    _, _, _, near_low = parameter_bounds(ranges)
+    for param, near_limit_threshold in zip(ranges, near_low):
+        if param in columns and n_rows:
+            col_idx = list(columns).index(param)
+            worksheet.conditional_format(1, col_idx, n_rows, col_idx, {
                 'type': 'cell',
                 'criteria': '>=',
-                'value': near_limit_threshold,
+                'value': float(near_limit_threshold),
                 'format': yellow_format,
             })
 
 
-def create_and_export_synthetic_dataset():
-    data = generate_dataset(ranges, n_samples)
-    df = pd.DataFrame(data)
-    df.to_csv("synthetic_water_quality.csv", index=False)
-    highlight_and_export_to_excel(df)
-    df.to_excel("synthetic_water_quality.xlsx", index=False, sheet_name='Data')
+def export_dataset(chunks, formats=EXPORT_FORMATS, basename="synthetic_water_quality",
+                   excel_path="highlighted_data.xlsx"):
+    """Write each DataFrame chunk once to every selected format: CSV, highlighted XLSX and Parquet."""
+    print(f"exporting {', '.join(formats)}...")
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown export formats {sorted(unknown)}, expected some of {EXPORT_FORMATS}")
+
+    rows = excel_rows = 0
+    columns = workbook = worksheet = None
+    writers = [DatasetWriter(f"{basename}.{fmt}") for fmt in ("csv", "parquet") if fmt in formats]
+    try:
+        for chunk in chunks:
+            for writer in writers:
+                writer.write(chunk)
+
+            if "xlsx" in formats:
+                if workbook is None:
+                    columns = chunk.columns
+                    workbook, worksheet = open_highlighted_workbook(excel_path, columns)
+                room = EXCEL_MAX_ROWS - 1 - excel_rows
+                if len(chunk) > room:
+                    print(f"warning: {excel_path} is cut at Excel's limit of {EXCEL_MAX_ROWS} rows")
+                part = chunk.iloc[:room]
+                if part.isna().any(axis=None):
+                    part = part.astype(object).where(part.notna(), None)  # blank cells, like to_excel
+                for row_idx, values in enumerate(part.itertuples(index=False, name=None), start=excel_rows + 1):
+                    worksheet.write_row(row_idx, 0, values)
+                excel_rows += len(part)
+
+            rows += len(chunk)
+    finally:
+        for writer in writers:
+            writer.close()
+        if workbook is not None:
+            highlight_near_limit_values(workbook, worksheet, columns, excel_rows)
+            workbook.close()
+    return rows
+
+
+def create_and_export_synthetic_dataset(rows=n_samples, formats=EXPORT_FORMATS, seed=None, chunk_size=1_000_000):
+    return export_dataset(iter_dataset_chunks(rows, chunk_size=chunk_size, seed=seed), formats)
 
 
 def calculate_soft_score(sample_dict, ranges):
@@ -54,7 +93,52 @@ def calculate_soft_score(sample_dict, ranges):
     return sum(scores) / len(scores) * 100 if scores else 0
 
 
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs="?", default="predict", choices=["predict", "generate", "train", "search", "export"])
+    parser.add_argument("--rows", type=int, default=n_samples, help="rows to generate")
+    parser.add_argument("--workers", type=int, default=None, help="generator processes, all cores by default")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--shard-rows", type=int, default=1_000_000, help="rows per parquet part")
+    parser.add_argument("--output", default="synthetic_water_quality", help="directory of the parquet parts")
+    parser.add_argument("--realistic", action="store_true", help="sample around real_measurements.xlsx")
+    parser.add_argument("--input", default="synthetic_water_quality.csv", help="CSV file or parquet file/directory to train on")
+    parser.add_argument("--batch-rows", type=int, default=None, help="stream the input in batches of this many rows")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--publish", default=None, help="also copy the model here, e.g. ../backend/model.pkl")
+    parser.add_argument("--compact", action="store_true",
+                        help="save the compressed float32 .npz the backend loads directly (MODEL_PATH=model.npz)")
+    parser.add_argument("--max-rows", type=int, default=500_000, help="rows used by the hyperparameter search")
+    parser.add_argument("--metric", default="accuracy", choices=["accuracy", "auc"])
+    parser.add_argument("--formats", default=",".join(EXPORT_FORMATS), help="comma-separated export formats")
+    parser.add_argument("--tolerance", type=float, default=0.005, help="accepted metric loss for a smaller model")
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
+
+    if args.command == "generate":
+        parts = write_sharded_dataset(args.output, args.rows, seed=args.seed, workers=args.workers,
+                                      shard_size=args.shard_rows, realistic=args.realistic)
+        print(f"{args.rows} rows written to {len(parts)} parts in {args.output}/")
+        raise SystemExit(0)
+
+    if args.command == "train":
+        train_model(args.input, batch_rows=args.batch_rows, n_estimators=args.n_estimators, n_jobs=args.n_jobs,
+                    publish_to=args.publish, compact=args.compact)
+        raise SystemExit(0)
+
+    if args.command == "search":
+        search_hyperparameters(args.input, max_rows=args.max_rows, metric=args.metric, tolerance=args.tolerance,
+                               workers=args.workers or -1, publish_to=args.publish, compact=args.compact)
+        raise SystemExit(0)
+
+    if args.command == "export":
+        formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+        create_and_export_synthetic_dataset(args.rows, formats=formats, seed=args.seed)
+        raise SystemExit(0)
 
     # create_and_export_synthetic_dataset()
 
@@ -0,0 +1,135 @@
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import time
+import joblib
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+from train_model import iter_frames, save_model, write_metadata
+
+DEFAULT_GRID = {
+    "n_estimators": [25, 50, 100, 200],
+    "max_depth": [None, 8, 12, 16],
+    "min_samples_leaf": [1, 5, 20],
+}
+
+
+def _fit_candidate(params, X_train, y_train, X_test, y_test, directory, random_state):
+    start = time.perf_counter()
+    model = RandomForestClassifier(n_jobs=1, random_state=random_state, **params)
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    proba = model.predict_proba(X_test)
+    path = os.path.join(directory, "-".join(f"{k}={v}" for k, v in params.items()) + ".pkl")
+    joblib.dump(model, path)
+    return {
+        "params": params,
+        "accuracy": float(accuracy_score(y_test, model.classes_.take(proba.argmax(axis=1)))),
+        "auc": float(roc_auc_score(y_test, proba[:, 1])),
+        "fit_seconds": round(fit_seconds, 3),
+        "size_bytes": os.path.getsize(path),
+        "node_count": int(sum(estimator.tree_.node_count for estimator in model.estimators_)),
+        "path": path,
+    }
+
+
+def _median_seconds(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def measure_serving(candidate, X_test, batch_size=1000, repeat=30):
+    """Load time and single-row/batch latency, one candidate at a time so they do not compete for cores."""
+    start = time.perf_counter()
+    model = joblib.load(candidate["path"])
+    candidate["load_seconds"] = round(time.perf_counter() - start, 4)
+    # the backend scores with the default single-job setting
+    model.set_params(n_jobs=None)
+
+    row = X_test.iloc[:1]
+    batch = X_test.iloc[:batch_size]
+    candidate["single_row_ms"] = round(_median_seconds(lambda: model.predict_proba(row), repeat) * 1000, 3)
+    candidate["batch_us_per_row"] = round(
+        _median_seconds(lambda: model.predict_proba(batch), max(3, repeat // 5)) / len(batch) * 1e6, 3)
+
+
+def pick_smallest(candidates, metric="accuracy", tolerance=0.005):
+    """Smallest serialized model whose metric is within `tolerance` of the best candidate's."""
+    best = max(candidate[metric] for candidate in candidates)
+    eligible = [candidate for candidate in candidates if candidate[metric] >= best - tolerance]
+    return min(eligible, key=lambda candidate: (candidate["size_bytes"], candidate["single_row_ms"]))
+
+
+def search_hyperparameters(source="synthetic_water_quality.csv", grid=None, max_rows=500_000, test_size=0.2,
+                           metric="accuracy", tolerance=0.005, workers=-1, random_state=42,
+                           report_path="model_search.json", output_dir="models", publish_to=None, compact=False):
+    """Fit every grid combination in parallel, measure quality, size and latency, keep the smallest good one.
+
+    Features are float32 for every candidate, like in train_model: sklearn's trees split on float32
+    anyway, so float64 inputs would only cost memory and give the same model.
+    """
+    grid = grid or DEFAULT_GRID
+    print("hyperparameter search...")
+    X, y = next(iter_frames(source, max_rows))
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+    combinations = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    print(f"{len(combinations)} candidates on {len(X_train)} training rows")
+
+    with tempfile.TemporaryDirectory() as directory:
+        candidates = Parallel(n_jobs=workers, verbose=5)(
+            delayed(_fit_candidate)(params, X_train, y_train, X_test, y_test, directory, random_state)
+            for params in combinations
+        )
+        for candidate in candidates:
+            measure_serving(candidate, X_test)
+
+        chosen = pick_smallest(candidates, metric=metric, tolerance=tolerance)
+        best = max(candidates, key=lambda candidate: candidate[metric])
+
+        print(f"{'n_est':>5} {'depth':>5} {'leaf':>4} {'accuracy':>8} {'auc':>6} {'size MB':>8} "
+              f"{'load ms':>8} {'1 row ms':>8} {'batch us/row':>12}")
+        for candidate in sorted(candidates, key=lambda candidate: candidate["size_bytes"]):
+            params = candidate["params"]
+            marker = " <- chosen" if candidate is chosen else " <- best" if candidate is best else ""
+            print(f"{params['n_estimators']:>5} {str(params['max_depth']):>5} {params['min_samples_leaf']:>4} "
+                  f"{candidate['accuracy']:>8.4f} {candidate['auc']:>6.4f} {candidate['size_bytes'] / 2 ** 20:>8.2f} "
+                  f"{candidate['load_seconds'] * 1000:>8.1f} {candidate['single_row_ms']:>8.2f} "
+                  f"{candidate['batch_us_per_row']:>12.2f}{marker}")
+
+        model = joblib.load(chosen["path"])
+        version, path = save_model(model, output_dir, publish_to, compact=compact)
+
+    for candidate in candidates:
+        del candidate["path"]
+    report = {
+        "source": source,
+        "train_rows": len(X_train),
+        "test_rows": len(X_test),
+        "metric": metric,
+        "tolerance": tolerance,
+        "best": best,
+        "chosen": chosen,
+        "candidates": candidates,
+    }
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    metadata = write_metadata(model, path, version, {
+        "source": source,
+        "train_rows": len(X_train),
+        "test_rows": len(X_test),
+        "metrics": {"accuracy": chosen["accuracy"], "auc": chosen["auc"]},
+        "search": {"metric": metric, "tolerance": tolerance, "best": best, "report": report_path},
+    })
+    print(f"chosen {chosen['params']} ({chosen['size_bytes'] / 2 ** 20:.2f} MB, {metric} {chosen[metric]:.4f}), "
+          f"best {best['params']} ({best['size_bytes'] / 2 ** 20:.2f} MB, {metric} {best[metric]:.4f})")
+    return model, metadata
@@ -1,4 +1,7 @@
+import hashlib
+import os
 import numpy as np
+import pandas as pd
 
 selected_params = ['ammonium', 'fosfaat', 'COD', 'Biochemisch zuurstofverbruik over 5 dagen',
                    'Geleidendheid', 'Zuurgraad', 'stikstof totaal', 'nitraat', 'Turbidity', 'TSS']
@@ -25,14 +28,40 @@ rename_map = {
 }
 
 
-def read_data(df):
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_measurements(path='real_measurements.xlsx', sheet_name='20025', cache_dir='.cache'):
+    """The Excel sheet as a DataFrame, read from a Parquet copy keyed on the file's hash after the first run."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f"{name}-{sheet_name}-{file_hash(path)[:16]}.parquet")
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    print(f"Converting {path} to {cache_path}...")
+    df = pd.read_excel(path, sheet_name=sheet_name)
+    # Excel columns can mix numbers and text, which Parquet cannot store in one column
+    for column in df.select_dtypes(include='object'):
+        df[column] = df[column].astype('string')
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+    return df
+
+
+def read_data(df, verbose=False):
     print("Reading real data...")
-    parameters_name = []
-    # df = pd.read_excel('real_measurements.xlsx', sheet_name='20025')
-    print(df.head())
-    for rec in df['OMS_PARAMETER']:
-        if rec not in parameters_name:
-            parameters_name.append(rec)
+    parameters_name = df['OMS_PARAMETER'].unique().tolist()
+    if verbose:
+        print(df.head())
+        print(f"{len(parameters_name)} parameters: {parameters_name}")
 
     selected_df = df[df['OMS_PARAMETER'].isin(selected_params)].copy()
 
@@ -50,32 +79,41 @@ def read_data(df):
     other_df.to_excel("other_parameters.xlsx", index=False)
 
 
-def extract_parameters(df):
-    print("Extracting valuable samples...")
-    param_values_dict = {}
+def measured_values(df):
+    """WAARDE_O of the measured selected parameters, grouped by OMS_PARAMETER in one pass."""
+    measured = [param for param in selected_params if param not in missing_params]
+    rows = df.loc[df['OMS_PARAMETER'].isin(measured), ['OMS_PARAMETER', 'WAARDE_O']]
+    # the cache stores WAARDE_O as text when any cell of the sheet is text (e.g. '<0.5'), back to numbers here
+    rows['WAARDE_O'] = pd.to_numeric(rows['WAARDE_O'], errors='coerce')
+    return rows.groupby('OMS_PARAMETER')['WAARDE_O']
 
-    for param in selected_params:
-        if param not in missing_params:
-            values = df[df['OMS_PARAMETER'] == param]['WAARDE_O'].tolist()
-            param_values_dict[rename_map[param]] = values
 
-    for param, values in param_values_dict.items():
-        print(f"{param} ({len(values)}):")
-        print(values)
-        print()
+def extract_parameters(df, verbose=False):
+    print("Extracting valuable samples...")
+    param_values_dict = {rename_map[param]: values.tolist() for param, values in measured_values(df)}
+
+    if verbose:
+        for param, values in param_values_dict.items():
+            print(f"{param} ({len(values)}):")
+            print(values)
+            print()
 
     return param_values_dict
 
 
-def calculate_means(df):
+def calculate_means(df, verbose=False):
     params_mean_values = {}
     params_std_values = {}
-    params_values = extract_parameters(df)
+    if verbose:
+        extract_parameters(df, verbose=True)
+    grouped = measured_values(df)
+    # population std, like np.std
+    means, stds = grouped.mean(), grouped.std(ddof=0)
 
     for param in selected_params:
         if param not in missing_params:
-            params_mean_values[rename_map[param]] = np.mean(params_values[rename_map[param]])
-            params_std_values[rename_map[param]] = np.std(params_values[rename_map[param]])
+            params_mean_values[rename_map[param]] = float(means.get(param, np.nan))
+            params_std_values[rename_map[param]] = float(stds.get(param, np.nan))
         else:
             params_mean_values[rename_map[param]] = assumed_means[param]
             params_std_values[rename_map[param]] = assumed_means[param]
@@ -1,36 +1,157 @@
+import json
+import math
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, confusion_matrix
+import sklearn
 import joblib
 import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.metrics import roc_curve, auc, accuracy_score
+from datasetGeneration import ranges
 
+FEATURES = list(ranges)
+LABEL = "Near_Limit"
+LATEST_MODEL = "near_limit_model.pkl"
+LATEST_COMPACT_MODEL = "near_limit_model.npz"
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+
+class StageReport:
+    """Wall time, peak traced allocations and peak RSS of each training stage."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        _, peak = tracemalloc.get_traced_memory()
+        record = {
+            "stage": name,
+            "seconds": round(time.perf_counter() - start, 3),
+            "peak_allocated_mb": round(peak / 2 ** 20, 1),
+            "max_rss_mb": max_rss_mb(),
+        }
+        self.stages.append(record)
+        print(f"[{name}] {record['seconds']} s, peak allocated {record['peak_allocated_mb']} MB, "
+              f"max RSS {record['max_rss_mb']} MB")
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / 2 ** 20 if sys.platform == "darwin" else rss / 2 ** 10, 1)
+
+
+def count_rows(source):
+    if os.path.isdir(source) or source.endswith(".parquet"):
+        import pyarrow.dataset as ds
+        return ds.dataset(source, format="parquet").count_rows()
+    # a line count without parsing, minus the header; the generated CSVs have no quoted newlines
+    lines, last = 0, b"\n"
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return max(lines + (last != b"\n") - 1, 0)
+
+
+def iter_frames(source, batch_rows):
+    """Features as float32 and labels as int8, batch_rows at a time, from parquet part(s) or a CSV file."""
+    if os.path.isdir(source) or source.endswith(".parquet"):
+        import pyarrow.dataset as ds
+        # pyarrow takes a C int here (and sys.maxsize means "everything"), the loop below builds full batches
+        batches = ds.dataset(source, format="parquet").to_batches(columns=FEATURES + [LABEL],
+                                                                  batch_size=min(batch_rows, 1 << 20))
+        frames = (batch.to_pandas() for batch in batches)
+    elif source.endswith(".csv"):
+        dtypes = {**{feature: np.float32 for feature in FEATURES}, LABEL: np.int8}
+        frames = pd.read_csv(source, usecols=FEATURES + [LABEL], dtype=dtypes, chunksize=batch_rows)
+    else:
+        raise ValueError(f"Unsupported training input {source}, expected a parquet directory/file or a .csv")
+
+    # parquet batches end at row group boundaries, regroup them into full batches
+    buffered, buffered_rows = [], 0
+    for frame in frames:
+        buffered.append(frame)
+        buffered_rows += len(frame)
+        while buffered_rows >= batch_rows:
+            combined = pd.concat(buffered, ignore_index=True) if len(buffered) > 1 else buffered[0]
+            yield _split_xy(combined.iloc[:batch_rows])
+            rest = combined.iloc[batch_rows:]
+            buffered, buffered_rows = ([rest], len(rest)) if len(rest) else ([], 0)
+    if buffered_rows:
+        yield _split_xy(pd.concat(buffered, ignore_index=True))
+
+
+def _split_xy(frame):
+    return frame[FEATURES].astype(np.float32), frame[LABEL].to_numpy(dtype=np.int8)
+
+
+def fit_in_memory(source, report, n_estimators, n_jobs, test_size, random_state, model_params):
+    with report.stage("load"):
+        X, y = next(iter_frames(source, sys.maxsize))
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+        del X, y
+
+    with report.stage("fit"):
+        model = RandomForestClassifier(n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state,
+                                       **model_params)
+        model.fit(X_train, y_train)
+    return model, X_test, y_test, len(X_train)
 
-def train_model():
-    print("model training...")
-    df = pd.read_csv("synthetic_water_quality.csv")
 
-    X = df.drop(columns=["Near_Limit"])
-    y = df["Near_Limit"]
+def fit_in_batches(source, report, batch_rows, n_estimators, n_jobs, test_size, max_test_rows, random_state,
+                   model_params):
+    """Warm-started forest: every batch of the stream adds its own share of the trees."""
+    n_batches = max(math.ceil(count_rows(source) / batch_rows), 1)
+    if n_batches > n_estimators:
+        print(f"warning: {n_batches} batches but only {n_estimators} trees, later batches are not used")
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    rng = np.random.default_rng(random_state)
+    model = RandomForestClassifier(n_estimators=0, warm_start=True, n_jobs=n_jobs, random_state=random_state,
+                                   **model_params)
+    test_X, test_y, test_rows, train_rows = [], [], 0, 0
 
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
-    model.fit(X_train, y_train)
+    with report.stage("stream+fit"):
+        for i, (X, y) in enumerate(iter_frames(source, batch_rows)):
+            trees = n_estimators * (i + 1) // n_batches - n_estimators * i // n_batches
+            held_out = rng.random(len(y)) < test_size
+            if test_rows < max_test_rows:
+                test_X.append(X[held_out].iloc[:max_test_rows - test_rows])
+                test_y.append(y[held_out][:max_test_rows - test_rows])
+                test_rows += len(test_y[-1])
+            if trees <= 0:
+                if model.n_estimators >= n_estimators:
+                    break
+                continue
 
-    y_pred = model.predict(X_test)
-    print("=== Confusion Matrix ===")
-    print(confusion_matrix(y_test, y_pred))
-    print("\n=== Classification Report ===")
-    print(classification_report(y_test, y_pred))
+            model.n_estimators += trees
+            model.fit(X[~held_out], y[~held_out])
+            train_rows += int((~held_out).sum())
+            print(f"batch {i}: {len(y)} rows, {model.n_estimators} trees")
 
-    accuracy = accuracy_score(y_test, y_pred)
-    print(f"Accuracy: {accuracy * 100:.2f}%")
+    return model, pd.concat(test_X, ignore_index=True), np.concatenate(test_y), train_rows
 
-    joblib.dump(model, "near_limit_model.pkl")
-    print("Model saved as 'near_limit_model.pkl'")
+
+def save_plots(y_test, y_pred, y_prob):
     plt.figure(figsize=(6, 4))
     sns.heatmap(confusion_matrix(y_test, y_pred), annot=True, fmt="d", cmap="Blues",
                 xticklabels=["Not Near Limit", "Near Limit"],
@@ -42,7 +163,6 @@ def train_model():
     plt.savefig("confusion_matrix.png")
     # plt.show()
 
-    y_prob = model.predict_proba(X_test)[:, 1]
     fpr, tpr, _ = roc_curve(y_test, y_prob)
     roc_auc = auc(fpr, tpr)
 
@@ -59,6 +179,108 @@ def train_model():
     # plt.show()
 
 
+def publish(path, target):
+    """Copy the artifact over target in one rename, so a running backend never loads half a file."""
+    tmp_path = f"{target}.tmp"
+    shutil.copyfile(path, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def train_model(source="synthetic_water_quality.csv", batch_rows=None, n_estimators=100, n_jobs=-1, test_size=0.2,
+                max_test_rows=500_000, random_state=42, output_dir="models", publish_to=None, plots=True, compact=False,
+                **model_params):
+    """Train on `source` (CSV, parquet file or directory of parquet parts) and write a versioned artifact.
+
+    Without batch_rows the whole dataset is loaded (as float32) and fitted at once. With it the input
+    is streamed and a warm-started forest grows by a share of the trees per batch, so only one batch
+    and the held-out rows are in memory. With compact the artifact is the .npz written by export_compact.
+    Returns the model and the artifact's metadata.
+    """
+    print("model training...")
+    report = StageReport()
+    if batch_rows:
+        model, X_test, y_test, train_rows = fit_in_batches(source, report, batch_rows, n_estimators, n_jobs,
+                                                           test_size, max_test_rows, random_state, model_params)
+    else:
+        model, X_test, y_test, train_rows = fit_in_memory(source, report, n_estimators, n_jobs, test_size,
+                                                          random_state, model_params)
+
+    with report.stage("evaluate"):
+        proba = model.predict_proba(X_test)
+        y_pred = model.classes_.take(proba.argmax(axis=1))
+        y_prob = proba[:, 1]
+        print("=== Confusion Matrix ===")
+        print(confusion_matrix(y_test, y_pred))
+        print("\n=== Classification Report ===")
+        print(classification_report(y_test, y_pred))
+        accuracy = accuracy_score(y_test, y_pred)
+        fpr, tpr, _ = roc_curve(y_test, y_prob)
+        roc_auc = auc(fpr, tpr)
+        print(f"Accuracy: {accuracy * 100:.2f}%")
+        if plots:
+            save_plots(y_test, y_pred, y_prob)
+
+    # n_jobs and warm_start were for training; the backend scores one row at a time on one core per worker
+    model.set_params(n_jobs=None, warm_start=False)
+    with report.stage("save"):
+        version, path = save_model(model, output_dir, publish_to, compact=compact)
+
+    metadata = write_metadata(model, path, version, {
+        "source": source,
+        "train_rows": train_rows,
+        "test_rows": len(y_test),
+        "metrics": {"accuracy": float(accuracy), "auc": float(roc_auc)},
+        "stages": report.stages,
+    })
+    return model, metadata
+
+
+def save_model(model, output_dir="models", publish_to=None, compact=False):
+    """Write models/near_limit_model-<version>.pkl (or .npz when compact) and publish it as the latest model."""
+    version = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    os.makedirs(output_dir, exist_ok=True)
+    if compact:
+        path = os.path.join(output_dir, f"near_limit_model-{version}.npz")
+        export_compact(model, path)
+        latest = LATEST_COMPACT_MODEL
+    else:
+        path = os.path.join(output_dir, f"near_limit_model-{version}.pkl")
+        # uncompressed, so the backend can memory-map it
+        joblib.dump(model, path)
+        latest = LATEST_MODEL
+    publish(path, latest)
+    if publish_to:
+        publish(path, publish_to)
+    print(f"Model saved as '{path}' (and '{latest}'{f', {publish_to!r}' if publish_to else ''})")
+    return version, path
+
+
+def export_compact(model, path):
+    """Write only what inference needs, in the layout backend/forest_engine.py loads directly."""
+    # the backend's CompiledForest defines the format, so the two cannot drift apart
+    if BACKEND_DIR not in sys.path:
+        sys.path.append(BACKEND_DIR)
+    from forest_engine import CompiledForest
+
+    CompiledForest.from_sklearn(model).save(path)
+
+
+def write_metadata(model, path, version, details):
+    metadata = {
+        "version": version,
+        "path": path,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "features": FEATURES,
+        "params": {k: v for k, v in model.get_params().items() if k not in ("warm_start", "n_jobs")},
+        "sklearn_version": sklearn.__version__,
+        "size_bytes": os.path.getsize(path),
+        **details,
+    }
+    with open(f"{path}.json", "w") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+
 def predict_from_sample(sample_dict):
 
     model = joblib.load("near_limit_model.pkl")
@@ -1,3 +1,5 @@
+REM development server with reload; production runs gunicorn (backend/gunicorn.conf.py), which needs Linux or macOS.
+REM to use several cores on Windows, drop --reload and add --workers N (no shared model memory).
 start powershell -Command "cd '%~dp0backend'; .\venv\Scripts\Activate.ps1; uvicorn main:app --reload --host 0.0.0.0 --port 8000"
 
 start powershell -Command "cd '%~dp0frontend'; npm run dev"